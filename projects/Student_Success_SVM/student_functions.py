@@ -4,9 +4,31 @@ import numpy as np
 import pandas as pd
 import sklearn
 import scipy.stats as stats
+import scipy.sparse as sparse
 from sklearn.calibration import CalibratedClassifierCV
 import matplotlib.pyplot as plt
-from time import time
+import sys
+import functools
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import resource
+
+# High-resolution clocks, with the closest Python 2 equivalents
+try:
+    from time import perf_counter, process_time
+except ImportError:
+    from timeit import default_timer as perf_counter
+    from time import clock as process_time
+
+# Memory tracing (Python 3.4+); Timer falls back to the peak RSS
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Units of ru_maxrss: bytes on macOS, kilobytes elsewhere
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
 
 # # Libraries for metric functions
 # from sklearn.metrics import (f1_score, accuracy_score, make_scorer, fbeta_score, 
@@ -42,6 +64,10 @@ from sklearn.metrics import classification_report, confusion_matrix
 # # Other utilities
 # from sklearn.cross_validation import train_test_split
 from sklearn.grid_search import GridSearchCV
+from sklearn.cross_validation import StratifiedKFold
+from sklearn.metrics.pairwise import linear_kernel, rbf_kernel, sigmoid_kernel
+from sklearn.svm import SVC
+from sklearn.base import clone
 # from sklearn.feature_selection import RFE
 # from sklearn.calibration import CalibratedClassifierCV, calibration_curve
 
@@ -99,31 +125,106 @@ from sklearn.grid_search import GridSearchCV
 # y_all_num = y_all.replace(['yes', 'no'], [1, 0])
 
 
+# Encode feature columns
+# @FeatureEncoder -
+# learns the layout of the feature columns once (fit) and then
+# encodes any batch of students into that same layout (transform),
+# so new students can be scored without rebuilding the columns.
+class FeatureEncoder(object):
+    ''' Converts yes/no columns into binary (0/1) columns and categorical
+    columns into dummy columns, e.g. 'school' => 'school_GP' and
+    'school_MS', with numeric columns passed through. The output is one
+    preallocated float matrix, dense or scipy.sparse (CSR). '''
+
+    def __init__(self, sparse=False):
+        self.sparse = sparse
+        self.features_ = None  # (column, kind, categories) for each input column
+        self.columns_ = None  # names of the output columns
+
+    def fit(self, X):
+        ''' Learns the yes/no columns and the categories of each categorical column. '''
+
+        self.features_ = []
+        self.columns_ = []
+        for col in X.columns:
+            col_data = X[col]
+            if col_data.dtype != object:
+                self.features_.append((col, 'numeric', None))
+                self.columns_.append(col)
+            elif set(col_data.unique()) <= set(['yes', 'no']):
+                self.features_.append((col, 'binary', None))
+                self.columns_.append(col)
+            else:
+                # Categories in sorted order, as pd.get_dummies orders them
+                categories = sorted(col_data.unique())
+                self.features_.append((col, 'categorical', categories))
+                self.columns_.extend('{}_{}'.format(col, value) for value in categories)
+        return self
+
+    def transform(self, X):
+        ''' Encodes X into the fitted columns. Categories not seen by fit
+        get zeros in every dummy column of their feature. '''
+
+        n = len(X)
+        rows = np.arange(n)
+        if self.sparse:
+            row_parts, col_parts, value_parts = [], [], []
+        else:
+            output = np.zeros((n, len(self.columns_)))
+
+        j = 0  # first output column of the current feature
+        for col, kind, categories in self.features_:
+            values = X[col].values
+            if kind == 'categorical':
+                codes = pd.Categorical(values, categories=categories).codes
+                known = codes >= 0
+                row_index, col_index, data = rows[known], j + codes[known], np.ones(known.sum())
+                width = len(categories)
+            else:
+                data = (values == 'yes').astype(float) if kind == 'binary' else values.astype(float)
+                row_index, col_index = rows, np.repeat(j, n)
+                width = 1
+
+            if self.sparse:
+                nonzero = data != 0
+                row_parts.append(row_index[nonzero])
+                col_parts.append(col_index[nonzero])
+                value_parts.append(data[nonzero])
+            else:
+                output[row_index, col_index] = data
+            j += width
+
+        if self.sparse:
+            return sparse.csr_matrix((np.concatenate(value_parts), (np.concatenate(row_parts), np.concatenate(col_parts))),
+                                     shape=(n, len(self.columns_)))
+        return output
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+
 # Preprocess feature columns
-def preprocess_features(X):
+def preprocess_features(X, encoder=None):
     ''' Preprocesses the student data and converts
     non-numeric binary variables into binary (0/1) variables.
-    Converts categorical variables into dummy variables. '''
-
-    # Initialize new output DataFrame
-    output = pd.DataFrame(index=X.index)
-
-    # Investigate each feature column for the data
-    for col, col_data in X.iteritems():
-
-        # If data type is non-numeric, replace all yes/no values with 1/0
-        if col_data.dtype == object:
-            col_data = col_data.replace(['yes', 'no'], [1, 0])
-
-        # If data type is categorical, convert to dummy variables
-        if col_data.dtype == object:
-            # Example: 'school' => 'school_GP' and 'school_MS'
-            col_data = pd.get_dummies(col_data, prefix=col)
-
-        # Collect the revised columns
-        output = output.join(col_data)
-
-    return output
+    Converts categorical variables into dummy variables.
+    Pass a fitted FeatureEncoder to reuse its column layout. '''
+
+    if encoder is None:
+        encoder = FeatureEncoder().fit(X)
+    output = pd.DataFrame(encoder.transform(X), index=X.index, columns=encoder.columns_)
+
+    # Column dtypes as before the encoder: numeric columns keep their
+    # own, binary columns are int64 and dummy columns uint8
+    dtypes = {}
+    for col, kind, categories in encoder.features_:
+        if kind == 'numeric':
+            dtypes[col] = X[col].dtype
+        elif kind == 'binary':
+            dtypes[col] = np.int64
+        else:
+            dtypes.update(('{}_{}'.format(col, value), np.uint8) for value in categories)
+    return output.astype(dtypes)
 
 # X_all = preprocess_features(X_all)
 
@@ -153,6 +254,14 @@ def preprocess_features(X):
 # Part 3: Training and Evaluating Models
 # =================================================
 
+# @Timer -
+# measures the wall-clock and CPU time (and optionally the peak
+# memory) of a block of code, as a context manager or decorator.
+
+# @measure -
+# calls a function repeatedly and summarizes its timings
+# (min, median, p95), after untimed warmup calls.
+
 # @train_classifier -
 # takes as input a classifier and training data,
 # fits the classifier to the data.
@@ -168,49 +277,121 @@ def preprocess_features(X):
 # training and testing data separately.
 
 
+class Timer(object):
+    ''' Times a block of code with perf_counter (wall clock) and
+    process_time (CPU), optionally tracing its peak memory:
+
+        with Timer() as t:
+            clf.fit(X_train, y_train)
+        print t.wall, t.cpu
+
+    Used as a decorator, it times every call of the function. The wall
+    time of each block or call is added to samples. Without tracemalloc
+    (Python 2), memory is the peak RSS of the process rather than of the
+    block, so it only bounds the block's usage from above. '''
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.wall = None  # seconds
+        self.cpu = None  # seconds
+        # Peak bytes allocated in the block; without tracemalloc (Python 2),
+        # the peak resident set size of the whole process so far
+        self.memory = None
+        self.samples = []
+
+    def __enter__(self):
+        if self.trace_memory and tracemalloc is not None:
+            tracemalloc.start()
+        self._cpu = process_time()
+        self._wall = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = perf_counter() - self._wall
+        self.cpu = process_time() - self._cpu
+        if self.trace_memory:
+            if tracemalloc is not None:
+                self.memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                self.memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+        self.samples.append(self.wall)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return timed
+
+    def stats(self):
+        return timing_stats(self.samples)
+
+
+def timing_stats(samples):
+    ''' Summarizes timing samples in seconds. '''
+
+    samples = np.asarray(samples)
+    return {'n': len(samples),
+            'min': samples.min(),
+            'median': np.median(samples),
+            'p95': np.percentile(samples, 95),
+            'mean': samples.mean()}
+
+
+def measure(func, repeats=1, warmup=0, trace_memory=False):
+    ''' Calls func warmup times untimed, then repeats times timed.
+    Returns the result of the last call and the timing stats of the
+    wall times, with the median CPU time and the peak memory if traced. '''
+
+    for _ in xrange(warmup):
+        func()
+    timer = Timer(trace_memory)
+    cpu, memory = [], []
+    for _ in xrange(repeats):
+        with timer:
+            result = func()
+        cpu.append(timer.cpu)
+        memory.append(timer.memory)
+    stats = timer.stats()
+    stats['cpu_median'] = np.median(cpu)
+    if trace_memory:
+        stats['memory_peak'] = max(memory)
+    return result, stats
+
+
+def format_timing(stats):
+    ''' Median time, with its spread when there are several samples. '''
+
+    if stats['n'] == 1:
+        return "{:.4f}".format(stats['median'])
+    return "{:.4f} (min {:.4f}, p95 {:.4f}, {} runs)".format(stats['median'], stats['min'], stats['p95'], stats['n'])
+
+
 def train_classifier(clf, X_train, y_train):
     ''' Fits a classifier to the training data. '''
 
-    # Start the clock, train the classifier, then stop the clock
-    start = time()
-    clf.fit(X_train, y_train)
-    end = time()
-    train_time = end - start
+    # Time training the classifier
+    with Timer() as timer:
+        clf.fit(X_train, y_train)
 
     # Print the results
-    print "Trained model in \t\t\t{:.4f}".format(train_time)
-
-
-def train_classifier_noP(clf, X_train, y_train):
-    start = time()
-    clf.fit(X_train, y_train)
-    end = time()
-    train_time = end - start
-    return train_time
+    print "Trained model in \t\t\t{:.4f}".format(timer.wall)
 
 
 def predict_labels(clf, features, target):
     ''' Makes predictions using a fit classifier based on F1 score. '''
 
-    # Start the clock, make predictions, then stop the clock
-    start = time()
-    y_pred = clf.predict(features)
-    end = time()
+    # Time making predictions
+    with Timer() as timer:
+        y_pred = clf.predict(features)
 
     # Print and return results
-    print "Made predictions in \t\t\t{:.4f}".format(end - start)
+    print "Made predictions in \t\t\t{:.4f}".format(timer.wall)
     return f1_score(target.values, y_pred, pos_label='yes')
 
 
-def predict_labels_noP(clf, features, target):
-    start = time
-    y_pred = clf.predict(features)
-    end = time()
-    predict_time = end - start
-    predict_f1_score = f1_score(target.values, y_pred, pos_label='yes')
-    return predict_time, predict_f1_score
-
-
 def train_predict(clf, X_train, y_train, X_test, y_test):
     ''' Train and predict using a classifer based on F1 score. '''
 
@@ -225,110 +406,71 @@ def train_predict(clf, X_train, y_train, X_test, y_test):
     print "F1 score for test set: \t\t\t{:.4f}".format(predict_labels(clf, X_test, y_test))
 
 
-def train_predict_noP(clf, X_train, y_train, X_test, y_test):
-    ''' Train and predict using a classifer based on F1 score. '''
-
-    # Training time
-    tc = train_classifier_noP(clf, X_train, y_train)
-
-    # Training set
-    pl_1 = predict_labels_noP(clf, X_train, y_train)
-
-    # Test set
-    pl_2 = predict_labels_noP(clf, X_test, y_test)
-
-    return tc, pl_1[0], pl_1[1], pl_2[0], pl_2[1]
-
-
-def train_predict_print(clf, X_train, y_train, X_test, y_test):
-    ''' Train and predict using a classifer based on F1 score, 
-    format and print the results. '''
-
-    # Indicate the classifier and the training set size
-    print "Training a {} using a training set size of {}. . .".format(clf.__class__.__name__, len(X_train))
-
-    tc = train_classifier_noP(clf, X_train, y_train)
-    print "Trained model in \t\t\t\t\t{:.4f}".format(tc)
-
-    # Training set
-    pl_1 = predict_labels_noP(clf, X_train, y_train)
-    print "Made predictions on training set in: \t\t\t{:.4f}".format(pl_1[0])
-    print "F1 score for training set: \t\t\t\t{:.4f}".format(pl_1[1])
-
-    # Test set
-    pl_2 = predict_labels_noP(clf, X_test, y_test)
-    print "Made predictions on test set in: \t\t\t{:.4f}".format(pl_2[0])
-    print "F1 score for test set: \t\t\t\t\t{:.4f}".format(pl_2[1])
-
-
 # Functions for training and testing
 # Functions perform same operations as the above functions but also identify variables for inbetween steps
 # @ train_classifier_noP: stands for train classifier no print
+# With repeats > 1 they return median times, after warmup untimed runs
 
 
-def train_classifier_noP(clf, X_train, y_train):
+def train_classifier_noP(clf, X_train, y_train, repeats=1, warmup=0):
     ''' Fits a classifier to the training data. '''
-    
-    # Start the clock, train the classifier, then stop the clock, return the time it takes
-    start = time()
-    clf.fit(X_train, y_train)
-    end = time()
-    
+
+    # Train the classifier, return the time it takes
+    _, stats = measure(lambda: clf.fit(X_train, y_train), repeats, warmup)
+
     # Store and return results
-    train_time = end - start # variable @train_time
+    train_time = stats['median'] # variable @train_time
     return train_time # return variable @train_time: the time it takes to fit/ train the model
 
-def predict_labels_noP(clf, features, target):
+def predict_labels_noP(clf, features, target, repeats=1, warmup=0):
     ''' Makes predictions using a fit classifier based on F1 score. '''
-    # Start the clock, make predictions, then stop the clock, return the time it takes with f1 scores
-    start = time()
-    y_pred = clf.predict(features)
-    end = time()
-    
+    # Make predictions, return the time it takes with f1 scores
+    y_pred, stats = measure(lambda: clf.predict(features), repeats, warmup)
+
     # Store calculated variables
     # variable @predict_time
-    predict_time = end - start 
+    predict_time = stats['median']
     # variable @predict_f1_score
     predict_f1_score = f1_score(target.values, y_pred, pos_label='yes')
-    
+
     # return variables @predict_time and @predict_f1_score
     return predict_time, predict_f1_score
 
 
 def train_predict_noP(clf, X_train, y_train, X_test, y_test):
     ''' Train and predict using a classifer based on F1 score. '''
-    
+
     # Training time
     tc = train_classifier_noP(clf, X_train, y_train)
-    
+
     # Training set
     pl_1 = predict_labels_noP(clf, X_train, y_train)
-    
+
     # Test set
     pl_2 = predict_labels_noP(clf, X_test, y_test)
-    
+
     return tc, pl_1[0], pl_1[1], pl_2[0], pl_2[1]
 
 
-def train_predict_print(clf, X_train, y_train, X_test, y_test):
-    ''' Train and predict using a classifer based on F1 score, 
+def train_predict_print(clf, X_train, y_train, X_test, y_test, repeats=1, warmup=0):
+    ''' Train and predict using a classifer based on F1 score,
     format and print the results. '''
-    
+
     # Indicate the classifier and the training set size
     print "Training a {} using a training set size of {}. . .".format(clf.__class__.__name__, len(X_train))
-    
-    tc = train_classifier_noP(clf, X_train, y_train)
-    print "Trained model in \t\t\t\t\t{:.4f}".format(tc)
-    
+
+    _, tc = measure(lambda: clf.fit(X_train, y_train), repeats, warmup)
+    print "Trained model in \t\t\t\t\t{}".format(format_timing(tc))
+
     # Training set
-    pl_1 = predict_labels_noP(clf, X_train, y_train)
-    print "Made predictions on training set in: \t\t\t{:.4f}".format(pl_1[0])
-    print "F1 score for training set: \t\t\t\t{:.4f}".format(pl_1[1])
-    
+    y_pred, pl_1 = measure(lambda: clf.predict(X_train), repeats, warmup)
+    print "Made predictions on training set in: \t\t\t{}".format(format_timing(pl_1))
+    print "F1 score for training set: \t\t\t\t{:.4f}".format(f1_score(y_train.values, y_pred, pos_label='yes'))
+
     # Test set
-    pl_2 = predict_labels_noP(clf, X_test, y_test)
-    print "Made predictions on test set in: \t\t\t{:.4f}".format(pl_2[0])
-    print "F1 score for test set: \t\t\t\t\t{:.4f}".format(pl_2[1])
+    y_pred, pl_2 = measure(lambda: clf.predict(X_test), repeats, warmup)
+    print "Made predictions on test set in: \t\t\t{}".format(format_timing(pl_2))
+    print "F1 score for test set: \t\t\t\t\t{:.4f}".format(f1_score(y_test.values, y_pred, pos_label='yes'))
 
 
 def clf_stats_all(clf, clf_info):
@@ -341,6 +483,199 @@ def clf_stats_all(clf, clf_info):
     print "Mean F1 score for test sets: {:,.4f}".format(np.mean(clf_info[4]))
 
 
+# =================================================
+# Classifier benchmark
+# Times train_classifier_noP and predict_labels_noP for several
+# classifiers and training set sizes, over a process pool.
+# @benchmark_classifiers returns one row per (classifier, training
+# set size); @evaluate_results converts it for visuals.evaluate.
+# =================================================
+
+def benchmark_task(task):
+    ''' Times one classifier on one training set size, in its own process.
+    The first warmup fits and predictions are not timed. A classifier
+    that raises gets a row of NaN metrics with the error, since a worker
+    exception would leave the pool waiting forever. '''
+
+    clf, X_train, y_train, X_test, y_test, size, warmup, repeats, pos_label = task
+    try:
+        return benchmark_row(clone(clf), X_train, y_train, X_test, y_test, size, warmup, repeats, pos_label)
+    except Exception as e:
+        return {'classifier': clf.__class__.__name__,
+                'train_size': size,
+                'repeats': repeats,
+                'error': "{}: {}".format(e.__class__.__name__, e)}
+
+
+def benchmark_row(clf, X_train, y_train, X_test, y_test, size, warmup, repeats, pos_label):
+    X_sub, y_sub = X_train[:size], y_train[:size]
+
+    for _ in xrange(warmup):
+        train_classifier_noP(clf, X_sub, y_sub)
+        clf.predict(X_test)
+
+    fit_times, predict_times = [], []
+    for _ in xrange(repeats):
+        fit_times.append(train_classifier_noP(clf, X_sub, y_sub))
+        predict_times.append(predict_labels_noP(clf, X_test, y_test)[0])
+
+    y_pred_train, y_pred_test = clf.predict(X_sub), clf.predict(X_test)
+    row = {'classifier': clf.__class__.__name__,
+           'train_size': size,
+           'repeats': repeats,
+           'acc_train': accuracy_score(y_sub, y_pred_train),
+           'f_train': f1_score(y_sub, y_pred_train, pos_label=pos_label),
+           'acc_test': accuracy_score(y_test, y_pred_test),
+           'f_test': f1_score(y_test, y_pred_test, pos_label=pos_label),
+           'fit_rows_per_sec': size / np.median(fit_times),
+           'predict_rows_per_sec': len(y_test) / np.median(predict_times),
+           # Peak resident memory of this worker process
+           'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT // 1024,
+           'error': None}
+    for name, times in [('fit', fit_times), ('predict', predict_times)]:
+        for q in [50, 90, 99]:
+            row['{}_p{}'.format(name, q)] = np.percentile(times, q)
+        row['{}_mean'.format(name)] = np.mean(times)
+    return row
+
+
+def benchmark_classifiers(classifiers, X_train, y_train, X_test, y_test, sizes=(0.01, 0.1, 1.0),
+                          warmup=1, repeats=5, processes=None, pos_label='yes', json_file=None):
+    ''' Benchmarks every classifier on every training set size.
+    Sizes up to 1.0 are fractions of the training set, larger ones are
+    numbers of rows, and none is smaller than the number of classes.
+    Each (classifier, size) runs in a fresh process, so its peak memory
+    is its own; keep processes low when the timings must not compete
+    for cores. Classifiers that raise get NaN metrics and an error. Returns a tidy DataFrame, also written
+    to json_file (one record per row) if given. '''
+
+    n = len(X_train)
+    n_classes = len(np.unique(y_train))
+    sizes = [int(round(size * n)) if size <= 1.0 else int(size) for size in sizes]
+    sizes = sorted(set(min(max(size, n_classes), n) for size in sizes))
+    tasks = [(clf, X_train, y_train, X_test, y_test, size, warmup, repeats, pos_label)
+             for clf in classifiers for size in sizes]
+
+    pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+    try:
+        rows = pool.map(benchmark_task, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    columns = ['classifier', 'train_size', 'repeats',
+               'fit_mean', 'fit_p50', 'fit_p90', 'fit_p99', 'fit_rows_per_sec',
+               'predict_mean', 'predict_p50', 'predict_p90', 'predict_p99', 'predict_rows_per_sec',
+               'peak_memory_kb', 'acc_train', 'f_train', 'acc_test', 'f_test', 'error']
+    results = pd.DataFrame(rows, columns=columns)
+    if json_file is not None:
+        results.to_json(json_file, orient='records')
+    return results
+
+
+def evaluate_results(results):
+    ''' Converts benchmark_classifiers results into the nested dict that
+    finding_donors visuals.evaluate plots: results[learner][i][metric],
+    with i indexing the training set sizes in increasing order and
+    median times. '''
+
+    nested = {}
+    for learner, rows in results.sort_values('train_size').groupby('classifier', sort=False):
+        nested[learner] = {}
+        for i, (_, row) in enumerate(rows.iterrows()):
+            nested[learner][i] = {'train_time': row['fit_p50'],
+                                  'pred_time': row['predict_p50'],
+                                  'acc_train': row['acc_train'],
+                                  'f_train': row['f_train'],
+                                  'acc_test': row['acc_test'],
+                                  'f_test': row['f_test']}
+    return nested
+
+
+# =================================================
+# Streaming predictions
+# Scores student records from a CSV file of any size: the file is
+# read in chunks, each chunk is encoded with a fitted FeatureEncoder
+# and predicted in batches over a pool of worker threads or
+# processes. Only one chunk is held in memory at a time.
+# =================================================
+
+# Classifier of each prediction worker, set by init_predict_worker
+worker_clf = None
+
+
+def init_predict_worker(clf):
+    global worker_clf
+    worker_clf = clf
+
+
+def predict_batch(X):
+    return worker_clf.predict(X)
+
+
+def stream_predict(clf, encoder, csv_file, output_file=None, target_col='passed', pos_label='yes',
+                   chunksize=10000, batch_size=1000, workers=1, processes=False):
+    ''' Predicts every record of csv_file with a trained classifier.
+
+    Records are read chunksize rows at a time, encoded with the fitted
+    encoder, and split into batches of batch_size rows predicted by
+    workers threads (or processes, if processes is True). Predictions
+    are appended to output_file as they are made, as the row number and
+    the predicted label. If the file has a target_col, a running
+    confusion matrix over clf.classes_ is kept, with its F1 score for
+    pos_label.
+
+    Returns a dict with the number of rows, the confusion matrix,
+    accuracy, F1, seconds taken and rows per second. '''
+
+    labels = list(clf.classes_)
+    confusion = np.zeros((len(labels), len(labels)), dtype=int)
+    n_rows = 0
+
+    if processes:
+        pool = multiprocessing.Pool(workers, initializer=init_predict_worker, initargs=(clf,))
+    else:
+        pool = ThreadPool(workers, initializer=init_predict_worker, initargs=(clf,))
+    output = open(output_file, 'w') if output_file is not None else None
+    try:
+        with Timer() as timer:
+            for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+                X = encoder.transform(chunk.drop(target_col, axis=1) if target_col in chunk else chunk)
+                batches = [X[start:start + batch_size] for start in xrange(0, X.shape[0], batch_size)]
+                y_pred = np.concatenate(pool.map(predict_batch, batches))
+
+                if output is not None:
+                    predictions = pd.DataFrame({'prediction': y_pred}, index=np.arange(n_rows, n_rows + len(y_pred)))
+                    predictions.to_csv(output, header=(n_rows == 0), index_label='row')
+                    output.flush()
+                if target_col in chunk:
+                    confusion += confusion_matrix(chunk[target_col].values, y_pred, labels=labels)
+                n_rows += len(y_pred)
+    finally:
+        pool.close()
+        pool.join()
+        if output is not None:
+            output.close()
+
+    # F1 of pos_label from the confusion matrix (rows: true, columns: predicted)
+    i = labels.index(pos_label) if pos_label in labels else None
+    f1 = np.nan
+    if i is not None and confusion.sum() > 0:
+        tp = confusion[i, i]
+        fp = confusion[:, i].sum() - tp
+        fn = confusion[i, :].sum() - tp
+        f1 = 2.0 * tp / (2 * tp + fp + fn) if tp + fp + fn > 0 else 0.0
+    accuracy = np.trace(confusion) * 1.0 / confusion.sum() if confusion.sum() > 0 else np.nan
+
+    return {'rows': n_rows,
+            'labels': labels,
+            'confusion_matrix': confusion,
+            'accuracy': accuracy,
+            'f1': f1,
+            'seconds': timer.wall,
+            'rows_per_sec': n_rows / timer.wall if timer.wall > 0 else np.nan}
+
+
 def plot_confusion_matrix(cm, title='Confusion matrix', cmap=plt.cm.Blues):
     '''Defines plot variables for confusion matrix'''
     plt.imshow(cm, interpolation='nearest', cmap=cmap)
@@ -442,19 +777,125 @@ def plot_calibration_curve(est, name, fig_index):
 
     plt.tight_layout()
 
-def svc_param_select(X, y):
-    start = time()
+# =================================================
+# SVC hyperparameter search
+# Candidates that share a kernel and gamma share their Gram (kernel)
+# matrices: each is computed once per fold and reused for every C,
+# with SVC(kernel='precomputed'). The (kernel, gamma) groups are
+# fitted in parallel over a process pool.
+# =================================================
+
+def gram_matrix(X, Y, kernel, gamma):
+    ''' Kernel matrix between the rows of X and Y, as SVC computes it.
+    A gamma of 'auto' means 1 / n_features. '''
+
+    if gamma == 'auto':
+        gamma = 1.0 / X.shape[1]
+    if kernel == 'linear':
+        return linear_kernel(X, Y)
+    if kernel == 'rbf':
+        return rbf_kernel(X, Y, gamma=gamma)
+    if kernel == 'sigmoid':
+        return sigmoid_kernel(X, Y, gamma=gamma, coef0=0.0)
+    raise ValueError("Unsupported kernel: {}".format(kernel))
+
+
+def fit_kernel_group(task):
+    ''' Scores every C of one (kernel, gamma) group by cross-validation,
+    training on the first n_train rows of each training fold.
+    Returns (C, mean accuracy, seconds) for each C. '''
+
+    X, y, folds, kernel, gamma, Cs, n_train = task
+    scores = dict((C, []) for C in Cs)
+    seconds = dict((C, 0.0) for C in Cs)
+    for train, test in folds:
+        train = train[:n_train]
+        with Timer() as gram_timer:
+            gram_train = gram_matrix(X[train], X[train], kernel, gamma)
+            gram_test = gram_matrix(X[test], X[train], kernel, gamma)
+        gram_time = gram_timer.wall / len(Cs)  # shared by the whole group
+        for C in Cs:
+            with Timer() as timer:
+                clf = SVC(kernel='precomputed', C=C)
+                clf.fit(gram_train, y[train])
+                scores[C].append(accuracy_score(y[test], clf.predict(gram_test)))
+            seconds[C] += timer.wall + gram_time
+    return [(C, np.mean(scores[C]), seconds[C]) for C in Cs]
+
+
+def svc_search(X, y, param_grid, n_folds=3, eta=3, min_train=None, processes=None, random_state=0):
+    ''' Cross-validated search of SVC kernel, C and gamma, with
+    successive halving: all candidates are first scored on a small
+    part of each training fold, then only the best 1 / eta of them go
+    on to a round with eta times more training rows, until the last
+    round uses all of them.
+
+    Returns a DataFrame with one row per candidate: its parameters,
+    its score in the last round it reached, that round and its total
+    wall time (fits, predictions and its share of the Gram matrices),
+    best candidates first. '''
+
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y)
+    # Training rows in random order, so every round trains on a random subset
+    rng = np.random.RandomState(random_state)
+    folds = [(rng.permutation(train), test)
+             for train, test in StratifiedKFold(y, n_folds=n_folds, shuffle=True, random_state=random_state)]
+    n_full = min(len(train) for train, test in folds)
+
+    # Candidates; the linear kernel does not use gamma
+    candidates = []
+    for kernel in param_grid['kernel']:
+        gammas = [None] if kernel == 'linear' else param_grid.get('gamma', ['auto'])
+        for gamma, C in itertools.product(gammas, param_grid['C']):
+            candidates.append({'kernel': kernel, 'gamma': gamma, 'C': C,
+                               'score': np.nan, 'round': 0, 'seconds': 0.0})
+
+    # Training rows of the first round, so that the last round uses them all
+    n_rounds = int(np.ceil(np.log(len(candidates)) / np.log(eta))) if len(candidates) > 1 else 1
+    n_train = min_train if min_train is not None else max(n_full // eta ** (n_rounds - 1), 10)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        alive = candidates
+        for rung in xrange(n_rounds):
+            if rung == n_rounds - 1:
+                n_train = n_full
+            groups = {}
+            for candidate in alive:
+                groups.setdefault((candidate['kernel'], candidate['gamma']), []).append(candidate)
+            keys = sorted(groups)
+            tasks = [(X, y, folds, kernel, gamma, [c['C'] for c in groups[(kernel, gamma)]], n_train)
+                     for kernel, gamma in keys]
+            for key, results in zip(keys, pool.map(fit_kernel_group, tasks)):
+                for candidate, (C, score, seconds) in zip(groups[key], results):
+                    candidate['score'] = score
+                    candidate['round'] = rung
+                    candidate['seconds'] += seconds
+            if n_train >= n_full:
+                break
+
+            # Keep the best 1 / eta of the candidates for the next round
+            alive = sorted(alive, key=lambda c: -c['score'])[:max(1, len(alive) // eta)]
+            n_train = min(n_train * eta, n_full)
+    finally:
+        pool.close()
+        pool.join()
+
+    results = pd.DataFrame(candidates, columns=['kernel', 'gamma', 'C', 'score', 'round', 'seconds'])
+    return results.sort_values(['round', 'score'], ascending=False).reset_index(drop=True)
+
+
+def svc_param_select(X, y, processes=None):
+    start = perf_counter()
     Cs = [1, 10, 100]
-    gammas = [0.01, 0, 1, 0.07]
+    gammas = [0.01, 'auto', 1, 0.07]
     ks = ['sigmoid', 'linear', 'rbf']
-    coefs = [-100000000, -100, 0, 1, 100]
-    deg = [1,2,4]
     param_grid = {'kernel': ks, 'C': Cs, 'gamma': gammas}
-    grid_search = GridSearchCV(SVC(), param_grid)
-    grid_search.fit(X, y)
-    grid_search.best_params_
-    end = time()
-    print "Best parameters: {}\n Best estimator: {}\n Best score: {}\n".format(grid_search.best_params_,
-                                                                               grid_search.best_estimator_,
-                                                                              grid_search.best_score_,)
-    print "Finished in {} seconds.".format(end-start)
\ No newline at end of file
+    results = svc_search(X, y, param_grid, processes=processes)
+    best = results.iloc[0]
+    end = perf_counter()
+    print "Best parameters: {}\n Best score: {}\n".format({'kernel': best['kernel'], 'C': best['C'], 'gamma': best['gamma']},
+                                                         best['score'])
+    print "Finished in {} seconds.".format(end-start)
+    return results
\ No newline at end of file
@@ -1,22 +1,49 @@
-import random
+import numpy as np
+
 from environment import Agent, Environment
 from planner import RoutePlanner
+from qtable import QTable, encode_state
+from replay import ReplayBuffer, terminal
 from simulator import Simulator
 
 class LearningAgent(Agent):
     """An agent that learns to drive in the smartcab world."""
 
-    def __init__(self, env):
+    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, replay_size=0, batch_size=32, gamma=0.0):
         # sets self.env = env, state = None, next_waypoint = None, and a default color
         super(LearningAgent, self).__init__(env)
         self.color = 'red'  # override color
         # simple route planner to get next_waypoint
         self.planner = RoutePlanner(self.env, self)
-        # TODO: Initialize any additional variables here
 
-    def reset(self, destination=None):
+        # Q-learning variables
+        self.learning = learning  # whether the agent is expected to learn
+        self.Q = QTable()  # Q-values indexed by encoded state and action
+        self.epsilon = epsilon  # random exploration factor
+        self.alpha = alpha  # learning factor
+
+        # Experience replay: past transitions are sampled again in batches
+        self.replay = None
+        if replay_size > 0:
+            self.replay = ReplayBuffer(replay_size, np.random.RandomState(self.env.random.randint(0, 2 ** 31 - 1)))
+        self.batch_size = batch_size  # transitions replayed per step
+        self.gamma = gamma  # discount of future rewards in replayed updates
+        self.transition = None  # last (state, action, reward), awaiting its next state
+
+    def reset(self, destination=None, testing=False):
         self.planner.route_to(destination)
-        # TODO: Prepare for a new trip; reset any variables here, if required
+
+        # The last transition of a trial has no next state
+        if self.transition is not None:
+            self.replay.add(*self.transition, next_state=terminal)
+            self.transition = None
+
+        # Decay exploration after each training trial, stop learning when testing
+        if testing:
+            self.epsilon = 0.0
+            self.alpha = 0.0
+        elif self.learning:
+            self.epsilon = max(self.epsilon - 0.05, 0.0)
 
     def update(self, t):
         # Gather inputs
@@ -25,21 +52,24 @@ class LearningAgent(Agent):
         inputs = self.env.sense(self)
         deadline = self.env.get_deadline(self)
 
-        # TODO: Update state
-        self.state = self.next_waypoint, inputs['light']
-        # self.state = self.next_waypoint, (inputs['oncoming'] == None or inputs['light'] == 'green')
-
-        # TODO: Select action according to your policy
-        # Define actions
-        actions = [None, 'forward', 'left', 'right']
+        # Update state: waypoint, light and traffic encoded as one integer
+        self.state = encode_state(self.next_waypoint, inputs)
 
-        # QUESTION 1- select random action
-        action = random.choice(actions)
+        # Select action according to the policy
+        if self.learning:
+            action = Environment.valid_actions[self.Q.choose_action(self.state, self.epsilon, self.env.random)]
+        else:
+            # QUESTION 1- select random action
+            action = self.env.random.choice(Environment.valid_actions)
 
         # Execute action and get reward
         reward = self.env.act(self, action)
 
-        # TODO: Learn policy based on state, action, reward
+        # Learn policy based on state, action, reward
+        if self.learning:
+            self.Q.update(self.state, Environment.valid_actions.index(action), reward, self.alpha)
+            if self.replay is not None:
+                self.learn_from_replay(Environment.valid_actions.index(action), reward)
 
 
         # Formatting ----- My own formatting style --------
@@ -47,6 +77,17 @@ class LearningAgent(Agent):
         # print "LearningAgent.update():\n\tdeadline = {}\n\tinputs = {}\n\taction = {}\n\treward = {}\n".format(deadline, inputs, action, reward)  # [debug]
         # print "Deadline:\t\t{}".format(deadline)
 
+    def learn_from_replay(self, action, reward):
+        """ Stores the latest transition and replays a batch of past ones. """
+
+        if self.transition is not None:
+            self.replay.add(*self.transition, next_state=self.state)
+        self.transition = (self.state, action, reward)
+
+        if len(self.replay) >= self.batch_size:
+            states, actions, rewards, next_states = self.replay.sample(self.batch_size)
+            self.Q.update_batch(states, actions, rewards, self.alpha, next_states, self.gamma)
+
 def run():
     """Run the agent for a finite number of trials."""
 
@@ -63,7 +104,8 @@ def run():
     # # create simulator (uses pygame when display=True, if available)
     sim = Simulator(e, update_delay=0.01, display=False)
     # NOTE: To speed up simulation,
-    # reduce update_delay and/or set display=False
+    # reduce update_delay and/or set display=False,
+    # or pass headless=True to step without any pacing
 
     # run for a specified number of trials
     sim.run(n_trials=100)
@@ -0,0 +1,150 @@
+import numpy as np
+
+from environment import Environment
+from planner import waypoint_table
+
+
+class BatchEnvironment(object):
+    """Many independent smartcab worlds stepped together as NumPy arrays.
+
+    Each world is a grid of traffic lights with a single primary agent and
+    no dummy traffic, so every world behaves like an `Environment` created
+    with `num_dummies=0`. Actions are given as indices into
+    `Environment.valid_actions` (0 = None, 1 = forward, 2 = left, 3 = right).
+    """
+
+    valid_actions = Environment.valid_actions
+    # Headings in the same (ENWS) order as Environment.valid_headings,
+    # so turning left is +1 and turning right is -1 (mod 4)
+    headings = np.array(Environment.valid_headings)
+    hard_time_limit = Environment.hard_time_limit
+
+    def __init__(self, n_worlds, grid_size=(8, 6), enforce_deadline=False, seed=None):
+        self.n_worlds = n_worlds
+        self.grid_size = grid_size  # (cols, rows)
+        self.enforce_deadline = enforce_deadline
+        self.random = np.random.RandomState(seed)
+        self.waypoints = waypoint_table(grid_size)
+
+        # Traffic lights, one grid per world (True = NS open, False = EW open)
+        shape = (n_worlds, grid_size[0], grid_size[1])
+        self.light_state = self.random.randint(0, 2, size=shape).astype(bool)
+        self.light_period = self.random.choice([3, 4, 5], size=shape)
+        self.light_last_updated = np.zeros(shape, dtype=int)
+
+        # Primary agent of each world; locations are 1-based like Environment
+        self.location = np.ones((n_worlds, 2), dtype=int)
+        self.heading = np.zeros(n_worlds, dtype=int)  # index into headings
+        self.destination = np.ones((n_worlds, 2), dtype=int)
+        self.deadline = np.zeros(n_worlds, dtype=int)
+
+        # Per-world simulation variables
+        self.done = np.zeros(n_worlds, dtype=bool)
+        self.success = np.zeros(n_worlds, dtype=bool)
+        self.t = np.zeros(n_worlds, dtype=int)
+        self.r = np.zeros(n_worlds, dtype=int)
+        self.n = np.zeros(n_worlds, dtype=int)
+        self.total_reward = np.zeros(n_worlds)
+
+        self._worlds = np.arange(n_worlds)
+
+    def reset(self, worlds=None):
+        """Start a new trial in the given worlds (all worlds by default)."""
+
+        worlds = self._worlds if worlds is None else np.asarray(worlds, dtype=int)
+        if len(worlds) == 0:
+            return
+
+        self.done[worlds] = False
+        self.success[worlds] = False
+        self.t[worlds] = 0
+        self.total_reward[worlds] = 0.0
+        self.n[worlds] += 1
+        self.light_last_updated[worlds] = 0
+
+        # Pick a start and a destination, redrawing pairs that are too close
+        cols, rows = self.grid_size
+        start = np.empty((len(worlds), 2), dtype=int)
+        destination = np.empty((len(worlds), 2), dtype=int)
+        min_dist = min(4, cols + rows - 2)
+        pending = np.arange(len(worlds))
+        while len(pending) > 0:
+            start[pending, 0] = self.random.randint(1, cols + 1, size=len(pending))
+            start[pending, 1] = self.random.randint(1, rows + 1, size=len(pending))
+            destination[pending, 0] = self.random.randint(1, cols + 1, size=len(pending))
+            destination[pending, 1] = self.random.randint(1, rows + 1, size=len(pending))
+            dist = np.abs(destination[pending] - start[pending]).sum(axis=1)
+            pending = pending[dist < min_dist]
+
+        self.location[worlds] = start
+        self.destination[worlds] = destination
+        self.heading[worlds] = self.random.randint(0, 4, size=len(worlds))
+        self.deadline[worlds] = np.abs(destination - start).sum(axis=1) * 5
+
+    def sense(self):
+        """Light seen by each world's primary agent (True = green)."""
+
+        x = self.location[:, 0] - 1
+        y = self.location[:, 1] - 1
+        state = self.light_state[self._worlds, x, y]
+        heading = self.headings[self.heading]
+        return (state & (heading[:, 1] != 0)) | (~state & (heading[:, 0] != 0))
+
+    def next_waypoint(self):
+        """Waypoint codes from each primary agent towards its destination,
+        as indices into valid_actions."""
+
+        cols, rows = self.grid_size
+        delta = self.destination - self.location
+        return self.waypoints[delta[:, 0] + cols - 1, delta[:, 1] + rows - 1, self.heading]
+
+    def step(self, actions):
+        """Advance every world that is not done by one time step.
+
+        Returns the reward each primary agent received, as Environment.act
+        would have given it. Worlds that are already done are left untouched
+        and get a reward of 0; call reset() on them to start a new trial.
+        """
+
+        actions = np.asarray(actions, dtype=int)
+        active = ~self.done
+        rewards = np.zeros(self.n_worlds)
+
+        # Update traffic lights
+        flip = (self.t[:, None, None] - self.light_last_updated >= self.light_period) & active[:, None, None]
+        self.light_state ^= flip
+        self.light_last_updated = np.where(flip, self.t[:, None, None], self.light_last_updated)
+
+        # Act; without traffic only the light decides whether a move is okay
+        waypoint = self.next_waypoint()
+        green = self.sense()
+        move_okay = green | (actions == 0) | (actions == 3)
+
+        turn = np.select([actions == 2, actions == 3], [1, 3], default=0)
+        moving = active & move_okay & (actions != 0)
+        self.heading = np.where(moving, (self.heading + turn) % 4, self.heading)
+        bounds = np.array(self.grid_size)
+        moved = (self.location - 1 + self.headings[self.heading]) % bounds + 1
+        self.location = np.where(moving[:, None], moved, self.location)
+
+        rewards[moving] = np.where(actions[moving] == waypoint[moving], 2.0, -0.5)
+        rewards[active & ~move_okay] = -1.0
+
+        arrived = active & (self.location == self.destination).all(axis=1)
+        on_time = arrived & (self.deadline >= 0)
+        rewards[on_time] += 10.0
+        self.done |= arrived
+        self.success |= on_time
+        self.r += arrived
+        self.total_reward += rewards
+
+        # Deadlines only run down in worlds still in progress
+        running = active & ~arrived
+        out_of_time = running & (self.deadline <= self.hard_time_limit)
+        if self.enforce_deadline:
+            out_of_time |= running & (self.deadline <= 0)
+        self.done |= out_of_time
+        self.deadline -= running
+        self.t += running
+
+        return rewards
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import random
+import argparse
+import platform
+from timeit import default_timer as timer
+
+import numpy as np
+
+from environment import Environment
+from agent import LearningAgent
+from simulator import Simulator
+
+
+def latency_stats(samples):
+    """Summarizes per-call latencies (in seconds) as microseconds."""
+
+    samples = np.asarray(samples) * 1e6
+    return {'calls': len(samples),
+            'mean_us': float(samples.mean()),
+            'p50_us': float(np.percentile(samples, 50)),
+            'p90_us': float(np.percentile(samples, 90)),
+            'p99_us': float(np.percentile(samples, 99)),
+            'calls_per_sec': float(1e6 / samples.mean())}
+
+
+def make_environment(grid_size, num_dummies, seed, vectorized=False):
+    env = Environment(num_dummies=num_dummies, verbose=False, rng=random.Random(seed), grid_size=grid_size,
+                      vectorized_traffic=vectorized)
+    agent = env.create_agent(LearningAgent, learning=True)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    return env, agent
+
+
+def time_calls(env, call, n_calls):
+    """Times n_calls of call(), starting a new trial whenever one ends."""
+
+    samples = []
+    env.reset()
+    for _ in xrange(n_calls):
+        if env.done:
+            env.reset()
+        start = timer()
+        call()
+        samples.append(timer() - start)
+    return latency_stats(samples)
+
+
+def benchmark_calls(grid_size, num_dummies, n_calls, seed=0, vectorized=False):
+    """Per-call latencies of the main environment and planner methods."""
+
+    env, agent = make_environment(grid_size, num_dummies, seed, vectorized)
+    actions = Environment.valid_actions
+
+    def act():
+        agent.next_waypoint = agent.planner.next_waypoint()
+        env.act(agent, env.random.choice(actions))
+
+    results = {}
+    results['Environment.reset'] = time_calls(env, env.reset, n_calls)
+    results['Environment.step'] = time_calls(env, env.step, n_calls)
+    results['Environment.sense'] = time_calls(env, lambda: env.sense(agent), n_calls)
+    results['Environment.act'] = time_calls(env, act, n_calls)
+    results['RoutePlanner.next_waypoint'] = time_calls(env, agent.planner.next_waypoint, n_calls)
+    return results
+
+
+def benchmark_run(grid_size, num_dummies, n_trials, seed=0, vectorized=False):
+    """Throughput of full headless Simulator.run trials."""
+
+    env, agent = make_environment(grid_size, num_dummies, seed, vectorized)
+    sim = Simulator(env, headless=True)
+    start = timer()
+    sim.run(n_trials=n_trials)
+    seconds = timer() - start
+    return {'trials': n_trials,
+            'seconds': seconds,
+            'trials_per_sec': n_trials / seconds,
+            'steps_per_sec': sim.steps_per_sec}
+
+
+def run(grids=((8, 6),), dummies=(3, 30, 100), trials=(10, 100), n_calls=2000, seed=0, vectorized=False):
+    """Benchmarks every combination of grid size, dummy count and trial count."""
+
+    results = []
+    for grid_size in grids:
+        for num_dummies in dummies:
+            calls = benchmark_calls(grid_size, num_dummies, n_calls, seed, vectorized)
+            for n_trials in trials:
+                results.append({'grid_size': list(grid_size),
+                                'num_dummies': num_dummies,
+                                'n_trials': n_trials,
+                                'calls': calls,
+                                'run': benchmark_run(grid_size, num_dummies, n_trials, seed, vectorized)})
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'vectorized_traffic': vectorized,
+            'results': results}
+
+
+def report(benchmark, baseline=None):
+    """Prints a summary table, with the speedup over a baseline if given."""
+
+    def key(result):
+        return (tuple(result['grid_size']), result['num_dummies'], result['n_trials'])
+
+    previous = dict((key(result), result) for result in baseline['results']) if baseline else {}
+    for result in benchmark['results']:
+        print "grid {} x {}, {} dummies, {} trials".format(result['grid_size'][0], result['grid_size'][1],
+                                                           result['num_dummies'], result['n_trials'])
+        old = previous.get(key(result))
+        for name, stats in sorted(result['calls'].items()):
+            line = "  {:<28}{:>10.1f} us  p50 {:>8.1f}  p90 {:>8.1f}  p99 {:>8.1f}".format(
+                name, stats['mean_us'], stats['p50_us'], stats['p90_us'], stats['p99_us'])
+            if old is not None and name in old['calls']:
+                line += "  x{:.2f}".format(old['calls'][name]['mean_us'] / stats['mean_us'])
+            print line
+        line = "  {:<28}{:>10.1f} steps/sec".format('Simulator.run', result['run']['steps_per_sec'])
+        if old is not None:
+            line += "  x{:.2f}".format(result['run']['steps_per_sec'] / old['run']['steps_per_sec'])
+        print line
+
+
+def grid(text):
+    """Parses a grid size given as COLSxROWS."""
+
+    cols, rows = text.lower().split('x')
+    return int(cols), int(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark smartcab simulation throughput.")
+    parser.add_argument('--grids', type=grid, nargs='+', default=[(8, 6)], help="grid sizes, e.g. 8x6 50x50")
+    parser.add_argument('--dummies', type=int, nargs='+', default=[3, 30, 100], help="numbers of dummy agents")
+    parser.add_argument('--trials', type=int, nargs='+', default=[10, 100], help="trial counts for Simulator.run")
+    parser.add_argument('--calls', type=int, default=2000, help="calls timed per method")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--vectorized', action='store_true', help="update dummy traffic in one array operation")
+    parser.add_argument('--output', default=os.path.join("logs", "benchmark.json"), help="JSON file for the results")
+    parser.add_argument('--baseline', help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    benchmark = run(args.grids, args.dummies, args.trials, args.calls, args.seed, args.vectorized)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(benchmark, baseline)
+
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(args.output, 'w') as f:
+        json.dump(benchmark, f, indent=2)
+    print "Results saved to {}".format(args.output)
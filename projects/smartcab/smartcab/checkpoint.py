@@ -0,0 +1,123 @@
+import os
+import pickle
+
+import numpy as np
+
+
+def pack(obj):
+    """Pickles an object (e.g. a RNG state) into a uint8 array."""
+
+    return np.frombuffer(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+
+
+def unpack(array):
+    return pickle.loads(array.tostring())
+
+
+def save(sim, filename, trials_left):
+    """Writes a snapshot of a simulation between two trials.
+
+    Holds the environment counters, RNG states, traffic lights, agent
+    waypoints and the primary agent's learned values; trials_left is
+    the number of trials of the current run still to go. The file is
+    written next to its destination and then renamed over it, so a
+    crash mid-write leaves the previous checkpoint intact.
+    """
+
+    env = sim.env
+    agent = env.primary_agent
+    data = {
+        'trials_left': trials_left,
+        'testing': sim.testing,
+        'counters': np.array([env.t, env.r, env.n]),
+        'total_reward': env.total_reward,
+        'random_state': pack(env.random.getstate()),
+        'light_state': env.lights.state,
+        'light_period': env.lights.period,
+        'light_last_updated': env.lights.last_updated,
+        'waypoints': np.array([env.valid_actions.index(other.next_waypoint)
+                               for other in env.agent_states], dtype=np.int8)}
+    if env.vectorized_traffic:
+        data['traffic_random_state'] = pack(env.traffic_random.get_state())
+    if sim.log is not None and sim.log.filename is not None:
+        sim.log.flush()
+        data['log_size'] = sim.log.log_file.tell()
+
+    # Learning agent
+    if getattr(agent, 'Q', None) is not None:
+        data['q_values'] = agent.Q.values
+        data['epsilon'] = agent.epsilon
+        data['alpha'] = agent.alpha
+    replay = getattr(agent, 'replay', None)
+    if replay is not None:
+        data['replay'] = np.array([replay.position, replay.size])
+        data['replay_states'] = replay.states
+        data['replay_actions'] = replay.actions
+        data['replay_rewards'] = replay.rewards
+        data['replay_next_states'] = replay.next_states
+        data['replay_random_state'] = pack(replay.random.get_state())
+        data['transition'] = pack(agent.transition)
+
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    temp_file = filename + '.tmp'
+    with open(temp_file, 'wb') as f:
+        np.savez(f, **data)
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)  # rename does not overwrite on Windows
+    os.rename(temp_file, filename)
+
+
+def load(sim, filename):
+    """Restores a snapshot written by save into a simulation set up the
+    same way (grid size, number of dummies, agent class). Returns the
+    number of trials left in the interrupted run. """
+
+    env = sim.env
+    agent = env.primary_agent
+    with open(filename, 'rb') as f:
+        data = dict(np.load(f).items())
+
+    sim.testing = bool(data['testing'])
+    env.t, env.r, env.n = [int(value) for value in data['counters']]
+    env.total_reward = float(data['total_reward'])
+    env.random.setstate(unpack(data['random_state']))
+    env.lights.state[:] = data['light_state']
+    env.lights.period[:] = data['light_period']
+    env.lights.last_updated[:] = data['light_last_updated']
+    for other, waypoint in zip(env.agent_states, data['waypoints']):
+        other.next_waypoint = env.valid_actions[waypoint]
+    if env.vectorized_traffic:
+        env.traffic_random.set_state(unpack(data['traffic_random_state']))
+        env.dummy_waypoints = None  # rebuilt from the dummies on the next step
+
+    if 'q_values' in data:
+        agent.Q.values[:] = data['q_values']
+        agent.epsilon = float(data['epsilon'])
+        agent.alpha = float(data['alpha'])
+    if 'replay' in data:
+        replay = agent.replay
+        replay.position, replay.size = [int(value) for value in data['replay']]
+        replay.states[:] = data['replay_states']
+        replay.actions[:] = data['replay_actions']
+        replay.rewards[:] = data['replay_rewards']
+        replay.next_states[:] = data['replay_next_states']
+        replay.random.set_state(unpack(data['replay_random_state']))
+        agent.transition = unpack(data['transition'])
+    return int(data['trials_left'])
+
+
+def resume(sim, filename, checkpoint_every=100):
+    """Continues the run interrupted after the checkpoint in filename,
+    checkpointing again to the same file as it goes. """
+
+    trials_left = load(sim, filename)
+    with open(filename, 'rb') as f:
+        data = np.load(f)
+        log_size = int(data['log_size']) if 'log_size' in data.files else None
+    if sim.log is not None and sim.log.filename is not None:
+        # Keep the rows logged up to the checkpoint, dropping any after it
+        sim.log.reopen(log_size)
+    sim.run(n_trials=trials_left, testing=sim.testing,
+            checkpoint_file=filename, checkpoint_every=checkpoint_every)
@@ -1,7 +1,10 @@
 import time
 import random
+import bisect
 from collections import OrderedDict
 
+import numpy as np
+
 from simulator import Simulator
 
 
@@ -10,9 +13,10 @@ class TrafficLight(object):
 
     valid_states = [True, False]  # True = NS open, False = EW open
 
-    def __init__(self, state=None, period=None):
-        self.state = state if state is not None else random.choice(self.valid_states)
-        self.period = period if period is not None else random.choice([3, 4, 5])
+    def __init__(self, state=None, period=None, rng=None):
+        rng = rng if rng is not None else random
+        self.state = state if state is not None else rng.choice(self.valid_states)
+        self.period = period if period is not None else rng.choice([3, 4, 5])
         self.last_updated = 0
 
     def reset(self):
@@ -24,6 +28,116 @@ class TrafficLight(object):
             self.last_updated = t
 
 
+class TrafficLights(object):
+    """The traffic lights of all intersections, held as NumPy arrays and
+    switched together in one vectorized update. """
+
+    def __init__(self, n, rng=None):
+        rng = rng if rng is not None else random
+        self.state = np.empty(n, dtype=bool)  # True = NS open, False = EW open
+        self.period = np.empty(n, dtype=np.int32)
+        self.last_updated = np.zeros(n, dtype=np.int32)
+        for i in xrange(n):
+            # Same draws, in the same order, as creating a TrafficLight for each
+            self.state[i] = rng.choice(TrafficLight.valid_states)
+            self.period[i] = rng.choice([3, 4, 5])
+
+    def reset(self):
+        self.last_updated[:] = 0
+
+    def update(self, t):
+        """Switches every light whose period has elapsed; returns the switched mask."""
+
+        switched = t - self.last_updated >= self.period
+        self.state ^= switched
+        self.last_updated[switched] = t
+        return switched
+
+
+class AgentRegistry(object):
+    """State of all agents as NumPy arrays (struct of arrays), indexed by
+    integer agent id. Locations are 1-based and headings index
+    Environment.valid_headings; a destination x of 0 means no destination. """
+
+    no_deadline = np.iinfo(np.int32).min
+
+    def __init__(self, capacity=16):
+        self.size = 0  # no. of registered agents
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.heading = np.zeros(capacity, dtype=np.int8)
+        self.deadline = np.full(capacity, self.no_deadline, dtype=np.int32)
+        self.destination_x = np.zeros(capacity, dtype=np.int32)
+        self.destination_y = np.zeros(capacity, dtype=np.int32)
+
+    def add(self):
+        """Registers a new agent and returns its id."""
+
+        if self.size == len(self.x):
+            # Double the capacity of every array
+            for name in ['x', 'y', 'heading', 'deadline', 'destination_x', 'destination_y']:
+                array = getattr(self, name)
+                grown = np.full(2 * len(array), self.no_deadline if name == 'deadline' else 0, dtype=array.dtype)
+                grown[:len(array)] = array
+                setattr(self, name, grown)
+        self.size += 1
+        return self.size - 1
+
+
+class AgentState(object):
+    """Handle on one agent's entry in the AgentRegistry of an environment.
+    Supports the 'location', 'heading', 'destination' and 'deadline' keys
+    of the per-agent state dicts the environment used to keep; setting the
+    location moves the agent in the environment's occupants index too. """
+
+    __slots__ = ('env', 'agent', 'id')
+
+    keys = ['location', 'heading', 'destination', 'deadline']
+
+    def __init__(self, env, agent, id):
+        self.env = env
+        self.agent = agent
+        self.id = id
+
+    @property
+    def agents(self):
+        return self.env.agents
+
+    def __getitem__(self, key):
+        agents, i = self.agents, self.id
+        if key == 'location':
+            return (agents.x.item(i), agents.y.item(i))
+        elif key == 'heading':
+            return Environment.valid_headings[agents.heading.item(i)]
+        elif key == 'destination':
+            if agents.destination_x.item(i) == 0:
+                return None
+            return (agents.destination_x.item(i), agents.destination_y.item(i))
+        elif key == 'deadline':
+            deadline = agents.deadline.item(i)
+            return None if deadline == agents.no_deadline else deadline
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        agents, i = self.agents, self.id
+        if key == 'location':
+            self.env.move_agent(self.agent, i, value)
+        elif key == 'heading':
+            agents.heading[i] = Environment.valid_headings.index(value)
+        elif key == 'destination':
+            agents.destination_x[i], agents.destination_y[i] = value if value is not None else (0, 0)
+        elif key == 'deadline':
+            agents.deadline[i] = value if value is not None else agents.no_deadline
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def get(self, key, default=None):
+        return self[key] if key in self.keys else default
+
+
 class Environment(object):
     """Environment within which all agents operate."""
 
@@ -38,8 +152,25 @@ class Environment(object):
     # end trial when deadline reaches this value (to avoid deadlocks)
     hard_time_limit = -100
 
-    def __init__(self, num_dummies=3):
+    def __init__(self, num_dummies=3, verbose=True, rng=None, grid_size=(8, 6), vectorized_traffic=False):
         self.num_dummies = num_dummies  # no. of dummy agents
+        self.verbose = verbose  # print trial and step updates
+        # Source of randomness for the environment and its agents, e.g. a
+        # seeded random.Random; defaults to the global random module
+        self.random = rng if rng is not None else random
+
+        # Vectorized traffic updates all dummy agents together as arrays,
+        # instead of calling DummyAgent.update on each one in turn
+        self.vectorized_traffic = vectorized_traffic
+        self.dummy_agents = []
+        self.other_agents = []  # agents updated one by one
+        self.dummy_ids = np.zeros(0, dtype=int)
+        self.dummy_waypoints = None  # waypoint codes of the dummies
+        if self.vectorized_traffic:
+            self.traffic_random = np.random.RandomState(self.random.randint(0, 2 ** 31 - 1))
+
+        # Optional recorder.TraceRecorder of every trial and step
+        self.recorder = None
 
         # Initialize simulation variables
         self.done = False
@@ -51,27 +182,29 @@ class Environment(object):
         self.n = 0
         # Running total of rewards
         self.total_reward = 0.0
+        # Agent -> AgentState handle on the arrays of the agent registry
         self.agent_states = OrderedDict()
+        self.agents = AgentRegistry()
+        # Agents at each intersection index as (agent id, agent) pairs, kept
+        # sorted so sense() sees co-located agents in agent_states order
+        self.occupants = {}
         self.status_text = ""
+        # Metrics of the current trial, as logged by the simulator
+        self.trial_data = {}
 
         # Road network
-        self.grid_size = (8, 6)  # (cols, rows)
+        self.grid_size = tuple(grid_size)  # (cols, rows)
         self.bounds = (1, 1, self.grid_size[0], self.grid_size[1])
         self.block_size = 100
+        # Intersection location -> index into self.locations and the light arrays
         self.intersections = OrderedDict()
-        self.roads = []
         for x in xrange(self.bounds[0], self.bounds[2] + 1):
             for y in xrange(self.bounds[1], self.bounds[3] + 1):
-                # a traffic light at each intersection
-                self.intersections[(x, y)] = TrafficLight()
-
-        for a in self.intersections:
-            for b in self.intersections:
-                if a == b:
-                    continue
-                # L1 distance = 1
-                if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:
-                    self.roads.append((a, b))
+                self.intersections[(x, y)] = len(self.intersections)
+        self.locations = list(self.intersections)
+        # a traffic light at each intersection
+        self.lights = TrafficLights(len(self.locations), rng=self.random)
+        self.build_roads()
 
         # Dummy agents
         for i in xrange(self.num_dummies):
@@ -81,123 +214,293 @@ class Environment(object):
         self.primary_agent = None  # to be set explicitly
         self.enforce_deadline = False
 
+    def build_roads(self):
+        """Builds the adjacency arrays of the grid and the list of roads."""
+
+        cols, rows = self.grid_size
+        x, y = np.divmod(np.arange(cols * rows), rows)  # 0-based, as indexed in self.locations
+
+        # Index of the intersection reached by driving each heading (with wrap-around)
+        self.neighbors = np.empty((cols * rows, len(self.valid_headings)), dtype=int)
+        for i, heading in enumerate(self.valid_headings):
+            self.neighbors[:, i] = (x + heading[0]) % cols * rows + (y + heading[1]) % rows
+
+        # Roads join intersections at L1 distance 1, in both directions
+        self.roads = []
+        for offset in [(-1, 0), (0, -1), (0, 1), (1, 0)]:
+            linked = (0 <= x + offset[0]) & (x + offset[0] < cols) & (0 <= y + offset[1]) & (y + offset[1] < rows)
+            for i in np.flatnonzero(linked):
+                a = self.locations[i]
+                self.roads.append((a, (a[0] + offset[0], a[1] + offset[1])))
+        self.roads.sort(key=lambda road: (road[0][0] - 1) * rows + road[0][1] - 1)
+
     def create_agent(self, agent_class, *args, **kwargs):
         agent = agent_class(self, *args, **kwargs)
-        self.agent_states[agent] = {'location':
-                                    random.choice(self.intersections.keys()),
-                                    'heading': (0, 1)}
+        state = AgentState(self, agent, self.agents.add())
+        state['location'] = self.random.choice(self.locations)
+        state['heading'] = (0, 1)
+        self.agent_states[agent] = state
+        self.add_occupant(agent, state.id)
+        if isinstance(agent, DummyAgent):
+            self.dummy_agents.append(agent)
+            self.dummy_ids = np.append(self.dummy_ids, state.id)
+            self.dummy_waypoints = None
+        else:
+            self.other_agents.append(agent)
         return agent
 
+    def location_index(self, x, y):
+        """Index of the intersection at (x, y) in self.locations."""
+        return (x - self.bounds[0]) * self.grid_size[1] + y - self.bounds[1]
+
+    def add_occupant(self, agent, id):
+        agents = self.agents
+        index = self.location_index(agents.x.item(id), agents.y.item(id))
+        bisect.insort(self.occupants.setdefault(index, []), (id, agent))
+
+    def remove_occupant(self, agent, id):
+        agents = self.agents
+        index = self.location_index(agents.x.item(id), agents.y.item(id))
+        self.occupants[index].remove((id, agent))
+
+    def move_agent(self, agent, id, location):
+        """Sets the location of an agent, and of its occupants entry once
+        it has one (from create_agent on). """
+
+        indexed = agent in self.agent_states
+        if indexed:
+            self.remove_occupant(agent, id)
+        self.agents.x[id], self.agents.y[id] = location
+        if indexed:
+            self.add_occupant(agent, id)
+
+    def rebuild_occupants(self):
+        """Rebuilds the occupants index from the agent registry, after its
+        locations were written directly. """
+
+        self.occupants.clear()
+        for agent, state in self.agent_states.iteritems():
+            self.add_occupant(agent, state.id)
+
     def set_primary_agent(self, agent, enforce_deadline=False):
         self.primary_agent = agent
         self.enforce_deadline = enforce_deadline
 
-    def reset(self):
+    def reset(self, testing=False):
         self.done = False
         self.t = 0
         self.total_reward = 0
         self.n += 1
 
         # Reset traffic lights
-        for traffic_light in self.intersections.itervalues():
-            traffic_light.reset()
+        self.lights.reset()
 
         # Pick a start and a destination
-        start = random.choice(self.intersections.keys())
-        destination = random.choice(self.intersections.keys())
+        start = self.random.choice(self.locations)
+        destination = self.random.choice(self.locations)
 
         # Ensure starting location and destination are not too close
-        while self.compute_dist(start, destination) < 4:
-            start = random.choice(self.intersections.keys())
-            destination = random.choice(self.intersections.keys())
+        min_dist = min(4, self.grid_size[0] + self.grid_size[1] - 2)
+        while self.compute_dist(start, destination) < min_dist:
+            start = self.random.choice(self.locations)
+            destination = self.random.choice(self.locations)
 
-        start_heading = random.choice(self.valid_headings)
+        start_heading = self.random.choice(self.valid_headings)
         deadline = self.compute_dist(start, destination) * 5
         # print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
         # ---- Add custom formating -----
-        print "********** Environment.reset() **********"
-        print "Trial set up!"
-        print "Trial Deadline: \t{}".format(deadline)
-        print "Trial Destination: \t{}".format(destination)
-        print "*****************************************\n"
+        if self.verbose:
+            print "********** Environment.reset() **********"
+            print "Trial set up!"
+            print "Trial Deadline: \t{}".format(deadline)
+            print "Trial Destination: \t{}".format(destination)
+            print "*****************************************\n"
+
+        self.trial_data = {
+            'trial': self.n,
+            'initial_deadline': deadline,
+            'final_deadline': deadline,
+            'net_reward': 0.0,
+            'actions': {0: 0, 1: 0, 2: 0, 3: 0, 4: 0},  # outcome -> count
+            'success': 0}
         # Initialize agent(s)
-        for agent in self.agent_states.iterkeys():
-            self.agent_states[agent] = {
-                'location': start if agent is self.primary_agent else random.choice(self.intersections.keys()),
-                'heading': start_heading if agent is self.primary_agent else random.choice(self.valid_headings),
-                'destination': destination if agent is self.primary_agent else None,
-                'deadline': deadline if agent is self.primary_agent else None}
-            agent.reset(destination=(destination if agent is self.primary_agent else None))
+        for agent, state in self.agent_states.iteritems():
+            state['location'] = start if agent is self.primary_agent else self.random.choice(self.locations)
+            state['heading'] = start_heading if agent is self.primary_agent else self.random.choice(self.valid_headings)
+            state['destination'] = destination if agent is self.primary_agent else None
+            state['deadline'] = deadline if agent is self.primary_agent else None
+            if agent is self.primary_agent:
+                agent.reset(destination=destination, testing=testing)
+            else:
+                agent.reset(destination=None)
+
+        if self.recorder is not None:
+            self.recorder.start_trial()
 
     def step(self):
         # print "Environment.step(): t = {}".format(self.t)
         # [debug]
 
         # Update traffic lights
-        for intersection, traffic_light in self.intersections.iteritems():
-            traffic_light.update(self.t)
+        switched = self.lights.update(self.t)
 
         # Update agents
-        for agent in self.agent_states.iterkeys():
-            agent.update(self.t)
+        if self.vectorized_traffic:
+            self.update_traffic()
+            for agent in self.other_agents:
+                agent.update(self.t)
+        else:
+            for agent in self.agent_states.iterkeys():
+                agent.update(self.t)
+
+        if self.recorder is not None:
+            self.recorder.record_step(switched)
 
         if self.done:
             return  # primary agent might have reached destination
 
         if self.primary_agent is not None:
-            agent_deadline = self.agent_states[self.primary_agent]['deadline']
+            id = self.agent_states[self.primary_agent].id
+            agent_deadline = self.agents.deadline.item(id)
             if agent_deadline <= self.hard_time_limit:
                 self.done = True
-                print "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.".format(self.hard_time_limit)
+                if self.verbose:
+                    print "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.".format(self.hard_time_limit)
             elif self.enforce_deadline and agent_deadline <= 0:
                 self.done = True
-                print "Environment.step(): Primary agent ran out of time! Trial aborted."
-                print "Destination successes: \t\t{}/{}".format(self.r, self.n)
-                print "Path cost for trial {} is: \t{}\n".format(self.n, self.total_reward)
-            self.agent_states[self.primary_agent]['deadline'] = agent_deadline - 1
+                if self.verbose:
+                    print "Environment.step(): Primary agent ran out of time! Trial aborted."
+                    print "Destination successes: \t\t{}/{}".format(self.r, self.n)
+                    print "Path cost for trial {} is: \t{}\n".format(self.n, self.total_reward)
+            self.agents.deadline[id] = agent_deadline - 1
 
         self.t += 1
 
+    def update_traffic(self):
+        """Senses and moves all dummy agents at once, following the rules of
+        DummyAgent.update. Dummies see the positions and waypoints from
+        the start of the step, rather than those of dummies updated before
+        them, since they all move together. """
+
+        if len(self.dummy_agents) == 0:
+            return
+        if self.dummy_waypoints is None:
+            self.dummy_waypoints = np.array([self.valid_actions.index(agent.next_waypoint)
+                                             for agent in self.dummy_agents], dtype=np.int8)
+
+        agents = self.agents
+        ids = self.dummy_ids
+        heading = agents.heading[:agents.size].astype(int)
+        index = (agents.x[:agents.size] - self.bounds[0]) * self.grid_size[1] + agents.y[:agents.size] - self.bounds[1]
+        waypoint = np.zeros(agents.size, dtype=np.int8)
+        waypoint[ids] = self.dummy_waypoints
+        for agent in self.other_agents:
+            waypoint[self.agent_states[agent].id] = self.valid_actions.index(agent.get_next_waypoint())
+
+        # Pair each dummy with every agent at its intersection, in id order
+        order = np.argsort(index, kind='mergesort')
+        sorted_index = index[order]
+        start = np.searchsorted(sorted_index, index[ids], side='left')
+        size = np.searchsorted(sorted_index, index[ids], side='right') - start
+        pair = np.repeat(np.arange(len(ids)), size)  # dummy position in ids
+        offset = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+        other = order[np.repeat(start, size) + offset]  # other agent id
+        relative = (heading[other] - heading[ids][pair]) % 4  # 2 = oncoming, 1 = right, 3 = left
+        other_waypoint = waypoint[other]
+        seen = (other != ids[pair]) & (relative != 0)
+
+        # Inputs, resolved as sense() does: 'left' wins for oncoming traffic,
+        # otherwise the last oncoming agent counts; 'forward' wins from the left
+        left_forward = np.bincount(pair[seen & (relative == 3) & (other_waypoint == 1)], minlength=len(ids)) > 0
+        oncoming = seen & (relative == 2)
+        oncoming_left = np.bincount(pair[oncoming & (other_waypoint == 2)], minlength=len(ids)) > 0
+        last = np.full(len(ids), -1)
+        np.maximum.at(last, pair[oncoming], np.flatnonzero(oncoming))
+        oncoming_waypoint = np.where(last >= 0, other_waypoint[last], 0)
+        oncoming_waypoint[oncoming_left] = 2
+        light = self.lights.state[index[ids]] == (heading[ids] % 2 == 1)  # green?
+
+        # Right-of-way checks of DummyAgent.update
+        action = self.dummy_waypoints.copy()  # redrawn below for the dummies that move
+        okay = np.select([action == 3, action == 1, action == 2],
+                         [light | ~left_forward,
+                          light,
+                          light & (oncoming_waypoint != 1) & (oncoming_waypoint != 3)])
+
+        # Move the dummies that may go and give them new waypoints
+        moved = np.flatnonzero(okay)
+        turn = np.array([0, 0, 1, 3])[action[moved]]
+        new_heading = (heading[ids[moved]] + turn) % 4
+        old_index = index[ids[moved]]
+        new_index = self.neighbors[old_index, new_heading]
+        x, y = np.divmod(new_index, self.grid_size[1])
+        agents.x[ids[moved]] = x + self.bounds[0]
+        agents.y[ids[moved]] = y + self.bounds[1]
+        agents.heading[ids[moved]] = new_heading
+        self.dummy_waypoints[moved] = self.traffic_random.randint(1, 4, size=len(moved))
+        if self.recorder is not None:
+            # Dummies that may not go stay put with a null action
+            self.recorder.actions[ids] = np.where(okay, action, 0) | 1 << 2 | self.dummy_waypoints << 3
+
+        for k, old, new in zip(moved.tolist(), old_index.tolist(), new_index.tolist()):
+            id, agent = ids.item(k), self.dummy_agents[k]
+            self.occupants[old].remove((id, agent))
+            bisect.insort(self.occupants.setdefault(new, []), (id, agent))
+            agent.next_waypoint = self.valid_actions[self.dummy_waypoints.item(k)]
+
     def sense(self, agent):
         assert agent in self.agent_states, "Unknown agent!"
 
-        state = self.agent_states[agent]
-        location = state['location']
-        heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+        agents = self.agents
+        id = self.agent_states[agent].id
+        heading = agents.heading.item(id)
+        index = self.location_index(agents.x.item(id), agents.y.item(id))
+        return self.sense_at(agent, index, heading)
+
+    def sense_at(self, agent, index, heading):
+        """Inputs of an agent at the given intersection index and heading index."""
 
-        # Populate oncoming, left, right
+        heading_x, heading_y = self.valid_headings[heading]
+        ns_open = self.lights.state.item(index)
+        light = 'green' if (ns_open and heading_y != 0) or ((not ns_open) and heading_x != 0) else 'red'
+
+        # Populate oncoming, left, right from the agents at this intersection;
+        # headings are ENWS indices, so oncoming traffic is heading + 2 and
+        # traffic approaching from the right is heading + 1
         oncoming = None
         left = None
         right = None
-        for other_agent, other_state in self.agent_states.iteritems():
-            if agent == other_agent or location != other_state['location'] or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
+        other_headings = self.agents.heading
+        for other_id, other_agent in self.occupants[index]:
+            other_heading = other_headings.item(other_id)
+            if agent == other_agent or heading == other_heading:
                 continue
-            other_heading = other_agent.get_next_waypoint()
-            if (heading[0] * other_state['heading'][0] + heading[1] * other_state['heading'][1]) == -1:
+            other_waypoint = other_agent.get_next_waypoint()
+            if other_heading == (heading + 2) % 4:
                 if oncoming != 'left':  # we don't want to override oncoming == 'left'
-                    oncoming = other_heading
-            elif (heading[1] == other_state['heading'][0] and -heading[0] == other_state['heading'][1]):
+                    oncoming = other_waypoint
+            elif other_heading == (heading + 1) % 4:
                 if right != 'forward' and right != 'left':  # we don't want to override right == 'forward or 'left'
-                    right = other_heading
+                    right = other_waypoint
             else:
                 if left != 'forward':  # we don't want to override left == 'forward'
-                    left = other_heading
+                    left = other_waypoint
 
         return {'light': light, 'oncoming': oncoming, 'left': left, 'right': right}
 
     def get_deadline(self, agent):
-        return self.agent_states[agent]['deadline'] if agent is self.primary_agent else None
+        return self.agents.deadline.item(self.agent_states[agent].id) if agent is self.primary_agent else None
 
     def act(self, agent, action):
         assert agent in self.agent_states, "Unknown agent!"
         assert action in self.valid_actions, "Invalid action!"
 
-        state = self.agent_states[agent]
-        location = state['location']
-        heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
-        inputs = self.sense(agent)
+        agents = self.agents
+        id = self.agent_states[agent].id
+        heading = agents.heading.item(id)
+        index = self.location_index(agents.x.item(id), agents.y.item(id))
+        inputs = self.sense_at(agent, index, heading)
+        light = inputs['light']
 
         # Move agent if within bounds and obeys traffic rules
         reward = 0  # reward/penalty
@@ -207,24 +510,23 @@ class Environment(object):
                 move_okay = False
         elif action == 'left':
             if light == 'green' and (inputs['oncoming'] == None or inputs['oncoming'] == 'left'):
-                heading = (heading[1], -heading[0])
+                heading = (heading + 1) % 4
             else:
                 move_okay = False
         elif action == 'right':
             if light == 'green' or inputs['left'] != 'forward':
-                heading = (-heading[1], heading[0])
+                heading = (heading + 3) % 4
             else:
                 move_okay = False
 
+        location = self.locations[index]
         if move_okay:
             # Valid move (could be null)
             if action is not None:
-                # Valid non-null move
-                location = ((location[0] + heading[0] - self.bounds[0]) % (self.bounds[2] - self.bounds[0] + 1) + self.bounds[0],
-                            (location[1] + heading[1] - self.bounds[1]) % (self.bounds[3] - self.bounds[1] + 1) + self.bounds[1])  # wrap-around
-                #if self.bounds[0] <= location[0] <= self.bounds[2] and self.bounds[1] <= location[1] <= self.bounds[3]:  # bounded
-                state['location'] = location
-                state['heading'] = heading
+                # Valid non-null move, to the neighboring intersection (wrap-around)
+                location = self.locations[self.neighbors.item(index, heading)]
+                self.move_agent(agent, id, location)
+                agents.heading[id] = heading
                 # valid, but is it correct? (as per waypoint)
                 reward = 2.0 if action == agent.get_next_waypoint() else -0.5
             else:
@@ -234,37 +536,73 @@ class Environment(object):
             # Invalid move
             reward = -1.0
 
+        if self.recorder is not None:
+            self.recorder.record_action(id, self.valid_actions.index(action), move_okay,
+                                        self.valid_actions.index(agent.get_next_waypoint()))
 
         if agent is self.primary_agent:
-            if state['location'] == state['destination']:
-                if state['deadline'] >= 0:
+            deadline = agents.deadline.item(id)
+            heading = self.valid_headings[heading]
+            if location[0] == agents.destination_x.item(id) and location[1] == agents.destination_y.item(id):
+                if deadline >= 0:
                     reward += 10.0  # bonus
+                    self.trial_data['success'] = 1
                 self.done = True
                 self.r += 1
                 # [debug]
-                print "********************************"
-                print "Environment.act(): Primary agent has reached destination!"
-                print "Destination successes: \t\t{}/{}".format(self.r,self.n)
-                print "Path cost for trial {} is: \t{}".format(self.n, self.total_reward + 10.0)
-            self.status_text = "deadline: {}\ntraffic: {}\nlight: {}\nstate: {}\naction: {}\nreward: {}".format(state['deadline'], inputs['oncoming'], inputs['light'],agent.get_state(), action, reward)
+                if self.verbose:
+                    print "********************************"
+                    print "Environment.act(): Primary agent has reached destination!"
+                    print "Destination successes: \t\t{}/{}".format(self.r,self.n)
+                    print "Path cost for trial {} is: \t{}".format(self.n, self.total_reward + 10.0)
+            self.status_text = "deadline: {}\ntraffic: {}\nlight: {}\nstate: {}\naction: {}\nreward: {}".format(deadline, inputs['oncoming'], inputs['light'],agent.get_state(), action, reward)
+            self.total_reward += reward
+
+            # Update metrics of the trial
+            self.trial_data['final_deadline'] = deadline - 1
+            self.trial_data['net_reward'] += reward
+            self.trial_data['actions'][self.action_outcome(action, light, inputs, move_okay)] += 1
+
             # My formatting style
             # Have terminal print more specific updates
-            self.total_reward += reward
-            print "------------ UPDATE ------------"
-            print "Deadline:\t\t{}".format(state['deadline'])
-            print "Started in state:\t{}".format(location)
-            print "Traffic:\t\t{}".format(inputs['oncoming'])
-            print "Light\t\t\t{}".format(inputs['light'])
-            print "Took action:\t\t{}".format(action)
-            print "Ended in state:\t\t({}, {})".format(heading[0] + location[0], heading[1] + location[1])
-            print "Got reward:\t\t{}\n".format(reward)
-            print "Tally of rewards:\t{}\n".format(self.total_reward)
+            if self.verbose:
+                print "------------ UPDATE ------------"
+                print "Deadline:\t\t{}".format(deadline)
+                print "Started in state:\t{}".format(location)
+                print "Traffic:\t\t{}".format(inputs['oncoming'])
+                print "Light\t\t\t{}".format(inputs['light'])
+                print "Took action:\t\t{}".format(action)
+                print "Ended in state:\t\t({}, {})".format(heading[0] + location[0], heading[1] + location[1])
+                print "Got reward:\t\t{}\n".format(reward)
+                print "Tally of rewards:\t{}\n".format(self.total_reward)
             # print "Environment.act() [POST]: location: {}, heading: {}, action: {}, reward: {}".format(location, heading, action, reward)
             ## [debug]
 
         
         return reward
 
+    def action_outcome(self, action, light, inputs, move_okay):
+        """Grades an action for the trial metrics:
+        0 = good, 1 = minor violation, 2 = major violation,
+        3 = minor accident, 4 = major accident. """
+
+        if action is None:
+            # Idling at a green light with nothing to yield to
+            if light == 'green' and inputs['oncoming'] != 'left':
+                return 1
+            return 0
+        if move_okay:
+            return 0
+        if light != 'green':
+            if action == 'right':
+                return 3  # turning right into traffic coming from the left
+            # Running a red light, into cross traffic or an oncoming right turn
+            if inputs['left'] == 'forward' or inputs['right'] == 'forward' or \
+                    (action == 'left' and inputs['oncoming'] == 'right'):
+                return 4
+            return 2
+        return 3  # turning left into oncoming traffic
+
     def get_reach(self):
         return self.r
 
@@ -288,7 +626,7 @@ class Agent(object):
         self.next_waypoint = None
         self.color = 'cyan'
 
-    def reset(self, destination=None):
+    def reset(self, destination=None, testing=False):
     # Resets the current state to the start state
         pass
 
@@ -305,11 +643,12 @@ class Agent(object):
 class DummyAgent(Agent):
     color_choices = ['blue', 'cyan', 'magenta', 'orange']
 
-    def __init__(self, env):
+    def __init__(self, env, rng=None):
         # sets self.env = env, state = None, next_waypoint = None, and a default color
         super(DummyAgent, self).__init__(env)
-        self.next_waypoint = random.choice(Environment.valid_actions[1:])
-        self.color = random.choice(self.color_choices)
+        self.random = rng if rng is not None else env.random
+        self.next_waypoint = self.random.choice(Environment.valid_actions[1:])
+        self.color = self.random.choice(self.color_choices)
 
     def update(self, t):
         inputs = self.env.sense(self)
@@ -328,7 +667,7 @@ class DummyAgent(Agent):
         action = None
         if action_okay:
             action = self.next_waypoint
-            self.next_waypoint = random.choice(Environment.valid_actions[1:])
+            self.next_waypoint = self.random.choice(Environment.valid_actions[1:])
         reward = self.env.act(self, action)
         #print "DummyAgent.update(): t = {}, inputs = {}, action = {}, reward = {}".format(t, inputs, action, reward)  # [debug]
         #print "DummyAgent.update(): next_waypoint = {}".format(self.next_waypoint)  # [debug]
\ No newline at end of file
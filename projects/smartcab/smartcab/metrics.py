@@ -0,0 +1,119 @@
+import os
+import csv
+
+import numpy as np
+
+# Counts of each action outcome (see Environment.action_outcome), in order
+outcome_fields = ['good_actions', 'minor_violations', 'major_violations', 'minor_accidents', 'major_accidents']
+
+# One trial of a binary (.trials) log: a fixed-size record with a typed
+# field for every metric, so logs can be memory-mapped as arrays
+TRIAL_DTYPE = np.dtype([('trial', '<i4'), ('testing', '?'), ('epsilon', '<f8'), ('alpha', '<f8'),
+                        ('initial_deadline', '<i4'), ('final_deadline', '<i4'), ('net_reward', '<f8')] +
+                       [(field, '<i4') for field in outcome_fields] +
+                       [('success', '?')])
+
+
+def is_binary(filename):
+    return filename.endswith('.trials')
+
+
+def load_trials(filename):
+    """Memory-maps a binary trial log as a structured array, without copying it."""
+
+    if os.path.getsize(filename) < TRIAL_DTYPE.itemsize:
+        return np.zeros(0, dtype=TRIAL_DTYPE)
+    return np.memmap(filename, dtype=TRIAL_DTYPE, mode='r',
+                     shape=(os.path.getsize(filename) // TRIAL_DTYPE.itemsize,))
+
+
+class TrialLogger(object):
+    """Buffered per-trial metrics log.
+    Rows use the schema that visuals.plot_trials reads from logs/. A
+    filename ending in .trials is written as binary TRIAL_DTYPE records
+    instead of CSV.
+    """
+
+    fields = ['trial', 'testing', 'parameters', 'initial_deadline',
+              'final_deadline', 'net_reward', 'actions', 'success']
+
+    def __init__(self, filename=None, buffer_size=100):
+        self.filename = filename  # None keeps every row in memory
+        self.buffer_size = buffer_size  # rows held before each write
+        self.binary = filename is not None and is_binary(filename)
+        self.rows = []
+
+        # The file is created on the first write, so that a resumed run
+        # can reopen an existing log instead
+        self.log_file = None
+        self.writer = None
+
+    def log_trial(self, trial_data, testing=False, parameters=None):
+        """Adds one row built from Environment.trial_data."""
+
+        row = dict(trial_data)
+        row['testing'] = testing
+        row['parameters'] = parameters if parameters is not None else {'e': 0.0, 'a': 0.0}
+        row['actions'] = dict(row['actions'])
+        self.rows.append(row)
+
+        if self.filename is not None and len(self.rows) >= self.buffer_size:
+            self.flush()
+
+    @staticmethod
+    def records(rows):
+        """Rows as an array of TRIAL_DTYPE records."""
+
+        records = np.zeros(len(rows), dtype=TRIAL_DTYPE)
+        for record, row in zip(records, rows):
+            record['trial'] = row['trial']
+            record['testing'] = row['testing']
+            record['epsilon'] = row['parameters']['e']
+            record['alpha'] = row['parameters']['a']
+            record['initial_deadline'] = row['initial_deadline']
+            record['final_deadline'] = row['final_deadline']
+            record['net_reward'] = row['net_reward']
+            for outcome, field in enumerate(outcome_fields):
+                record[field] = row['actions'][outcome]
+            record['success'] = row['success']
+        return records
+
+    def flush(self):
+        """Writes buffered rows to the log file."""
+
+        if self.filename is None:
+            return
+        if self.log_file is None:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.log_file = open(self.filename, 'wb')
+            if not self.binary:
+                self.writer = csv.DictWriter(self.log_file, fieldnames=self.fields)
+                self.writer.writeheader()
+        if self.binary:
+            self.records(self.rows).tofile(self.log_file)
+        else:
+            self.writer.writerows(self.rows)
+        self.log_file.flush()
+        self.rows = []
+
+    def reopen(self, size=None):
+        """Continues an existing log file, cut back to its first size bytes."""
+
+        if self.log_file is not None:
+            self.log_file.close()
+        self.rows = []
+        self.log_file = open(self.filename, 'r+b')
+        if size is not None:
+            self.log_file.truncate(size)
+        self.log_file.seek(0, os.SEEK_END)
+        if not self.binary:
+            self.writer = csv.DictWriter(self.log_file, fieldnames=self.fields)
+
+    def close(self):
+        if self.log_file is not None:
+            self.flush()
+            self.log_file.close()
+            self.log_file = None
+            self.writer = None
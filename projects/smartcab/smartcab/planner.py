@@ -1,76 +1,95 @@
-import random
+import numpy as np
+
+# Waypoints in the same order as Environment.valid_actions
+waypoints = [None, 'forward', 'left', 'right']
+# Headings in the same (ENWS) order as Environment.valid_headings
+headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]
+heading_index = dict((heading, i) for i, heading in enumerate(headings))
+
+# Waypoint tables already built, by grid size
+_waypoint_tables = {}
+
+
+def compute_waypoints(delta_a, heading, bounds):
+    """ Vectorized waypoint codes (indices into `waypoints`) for arrays of
+        (destination - location) offsets and heading indices. """
+
+    bounds = np.asarray(bounds)
+    delta_a = np.asarray(delta_a)
+    delta_b = np.where(delta_a <= 0, bounds + delta_a, delta_a - bounds)
+
+    # Calculate true difference in location based on world-wrap
+    delta = np.where(np.abs(delta_a) < np.abs(delta_b), delta_a, delta_b)
+    dx, dy = delta[..., 0], delta[..., 1]
+    heading = np.asarray(headings)[heading]
+    hx, hy = heading[..., 0], heading[..., 1]
+
+    # Destination cardinally East or West of location
+    east_west = np.select([dx * hx > 0,  # Heading the correct East or West direction
+                           (dx * hx < 0) & (hx < 0),  # Heading West, destination East
+                           (dx * hx < 0) & (hx > 0),  # Heading East, destination West
+                           dx * hy > 0],  # Heading North destination West; Heading South destination East
+                          [1,
+                           np.where(dy > 0, 2, 3),
+                           np.where(dy < 0, 2, 3),
+                           2],
+                          default=3)
+    # Destination cardinally North or South of location
+    north_south = np.select([dy * hy > 0,  # Heading the correct North or South direction
+                             (dy * hy < 0) & (hy < 0),  # Heading North, destination South
+                             (dy * hy < 0) & (hy > 0),  # Heading South, destination North
+                             dy * hx > 0],  # Heading West destination North; Heading East destination South
+                            [1,
+                             np.where(dx < 0, 2, 3),
+                             np.where(dx > 0, 2, 3),
+                             3],
+                            default=2)
+
+    return np.select([(dx == 0) & (dy == 0), dx != 0], [0, east_west], default=north_south)
+
+
+def waypoint_table(grid_size):
+    """ Lookup table of waypoint codes for a grid, built once per grid size.
+
+        The waypoint only depends on the offset to the destination and the
+        heading, so the table is indexed as
+        table[dx + cols - 1, dy + rows - 1, heading_index]
+        where (dx, dy) = destination - location. """
+
+    grid_size = tuple(grid_size)
+    if grid_size not in _waypoint_tables:
+        cols, rows = grid_size
+        dx, dy, heading = np.meshgrid(np.arange(1 - cols, cols), np.arange(1 - rows, rows),
+                                      np.arange(len(headings)), indexing='ij')
+        table = compute_waypoints(np.stack([dx, dy], axis=-1), heading, grid_size)
+        _waypoint_tables[grid_size] = table.astype(np.int8)
+    return _waypoint_tables[grid_size]
+
 
 class RoutePlanner(object):
     """ Complex route planner that is meant for a perpendicular grid network. """
 
-    def __init__(self, env, agent):
+    def __init__(self, env, agent, rng=None):
         self.env = env
         self.agent = agent
+        self.random = rng if rng is not None else env.random
         self.destination = None
+        self.table = waypoint_table(self.env.grid_size)
 
     def route_to(self, destination=None):
         """ Select the destination if one is provided, otherwise choose a random intersection. """
 
-        self.destination = destination if destination is not None else random.choice(self.env.intersections.keys())
+        self.destination = destination if destination is not None else self.random.choice(self.env.locations)
 
     def next_waypoint(self):
-        """ Creates the next waypoint based on current heading, location,
+        """ Looks up the next waypoint based on current heading, location,
             intended destination and L1 distance from destination. """
 
         # Collect global location details
         bounds = self.env.grid_size
-        location = self.env.agent_states[self.agent]['location']
-        heading = self.env.agent_states[self.agent]['heading']
-
-        delta_a = (self.destination[0] - location[0], self.destination[1] - location[1])
-        delta_b = (bounds[0] + delta_a[0] if delta_a[0] <= 0 else delta_a[0] - bounds[0], \
-                   bounds[1] + delta_a[1] if delta_a[1] <= 0 else delta_a[1] - bounds[1])
-
-        # Calculate true difference in location based on world-wrap
-        # This will pre-determine the need for U-turns from improper headings
-        dx = delta_a[0] if abs(delta_a[0]) < abs(delta_b[0]) else delta_b[0]
-        dy = delta_a[1] if abs(delta_a[1]) < abs(delta_b[1]) else delta_b[1]
-
-        # First check if destination is at location
-        if dx == 0 and dy == 0:
-            return None
-        
-        # Next check if destination is cardinally East or West of location    
-        elif dx != 0:
-
-            if dx * heading[0] > 0:  # Heading the correct East or West direction
-                return 'forward'
-            elif dx * heading[0] < 0 and heading[0] < 0: # Heading West, destination East
-                if dy > 0: # Destination also to the South
-                    return 'left'
-                else:
-                    return 'right'
-            elif dx * heading[0] < 0 and heading[0] > 0: # Heading East, destination West
-                if dy < 0: # Destination also to the North
-                    return 'left'
-                else:
-                    return 'right'
-            elif dx * heading[1] > 0: # Heading North destination West; Heading South destination East
-                return 'left'
-            else:
-                return 'right'
-
-        # Finally, check if destination is cardinally North or South of location
-        elif dy != 0:
-
-            if dy * heading[1] > 0:  # Heading the correct North or South direction
-                return 'forward'
-            elif dy * heading[1] < 0 and heading[1] < 0: # Heading North, destination South
-                if dx < 0: # Destination also to the West
-                    return 'left'
-                else:
-                    return 'right'
-            elif dy * heading[1] < 0 and heading[1] > 0: # Heading South, destination North
-                if dx > 0: # Destination also to the East
-                    return 'left'
-                else:
-                    return 'right'
-            elif dy * heading[0] > 0: # Heading West destination North; Heading East destination South
-                return 'right'
-            else:
-                return 'left'
\ No newline at end of file
+        agents = self.env.agents
+        id = self.env.agent_states[self.agent].id
+
+        return waypoints[self.table.item(self.destination[0] - agents.x.item(id) + bounds[0] - 1,
+                                         self.destination[1] - agents.y.item(id) + bounds[1] - 1,
+                                         agents.heading.item(id))]
@@ -0,0 +1,118 @@
+import json
+from timeit import default_timer as timer
+
+def targets(sim):
+    """Methods timed by a Profiler of sim, as (class, method name).
+
+    The classes are taken from the running objects rather than imported,
+    so that the primary agent is timed however its module was loaded
+    (e.g. as __main__).
+    """
+
+    env = sim.env
+    agent = env.primary_agent
+    methods = [(type(env), 'step'),
+               (type(env.lights), 'update'),
+               (type(env), 'update_traffic')]
+    methods += [(cls, 'update') for cls in set(type(other) for other in env.agent_states if other is not agent)]
+    if agent is not None:
+        methods.append((type(agent), 'update'))
+        if getattr(agent, 'planner', None) is not None:
+            methods.append((type(agent.planner), 'next_waypoint'))
+    methods += [(type(env), 'sense'),
+                (type(env), 'sense_at'),
+                (type(env), 'act'),
+                (type(sim), 'render')]
+    return methods
+
+
+class Profiler(object):
+    """Counts calls and cumulative time of the main simulation methods.
+
+    enable() wraps the methods in place, on their classes, and disable()
+    puts the originals back, so nothing is timed (or slowed down) while
+    the profiler is off. Times are inclusive: Environment.step contains
+    the agent updates, which contain sense and act. All sensing goes
+    through sense_at, called by sense and directly by act.
+    """
+
+    def __init__(self):
+        self.stats = {}  # name -> [calls, seconds]
+        self.originals = {}
+        self.elapsed = 0.0  # wall time between enable() and the last report
+        self.start_time = None
+
+    def enable(self, sim):
+        if self.originals:
+            return
+        for cls, name in targets(sim):
+            owner = self.owner(cls, name)
+            if (owner, name) in self.originals:
+                continue
+            original = owner.__dict__[name]
+            self.originals[(owner, name)] = original
+            setattr(owner, name, self.wrap(original, '{}.{}'.format(owner.__name__, name)))
+        self.start_time = timer()
+
+    @staticmethod
+    def owner(cls, name):
+        """The class (cls or a base of it) that defines the method name."""
+
+        for base in cls.__mro__:
+            if name in base.__dict__:
+                return base
+        raise AttributeError("{} has no method {}".format(cls.__name__, name))
+
+    def disable(self):
+        for (cls, name), original in self.originals.iteritems():
+            setattr(cls, name, original)
+        self.originals = {}
+
+    def wrap(self, method, name):
+        stats = self.stats.setdefault(name, [0, 0.0])
+
+        def timed(*args, **kwargs):
+            start = timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += timer() - start
+        timed.__name__ = method.__name__
+        timed.__doc__ = method.__doc__
+        return timed
+
+    def reset(self):
+        for stats in self.stats.itervalues():
+            stats[0] = 0
+            stats[1] = 0.0
+        self.start_time = timer()
+
+    def summary(self):
+        """Per-method calls, total and mean times, and share of wall time."""
+
+        if self.start_time is not None:
+            self.elapsed = timer() - self.start_time
+        rows = []
+        for name, (calls, seconds) in sorted(self.stats.iteritems(), key=lambda item: -item[1][1]):
+            if calls:
+                rows.append({'method': name,
+                             'calls': calls,
+                             'total_s': seconds,
+                             'mean_us': seconds / calls * 1e6,
+                             'percent': 100.0 * seconds / self.elapsed if self.elapsed > 0 else 0.0})
+        return {'elapsed_s': self.elapsed, 'methods': rows}
+
+    def report(self, json_file=None):
+        """Prints the summary as a table, or writes it to json_file."""
+
+        summary = self.summary()
+        if json_file is not None:
+            with open(json_file, 'w') as f:
+                json.dump(summary, f, indent=2)
+            return
+        print "Profile ({:.3f} secs):".format(summary['elapsed_s'])
+        print "  {:<28}{:>10}{:>12}{:>12}{:>8}".format('method', 'calls', 'total s', 'mean us', '%')
+        for row in summary['methods']:
+            print "  {:<28}{:>10}{:>12.3f}{:>12.1f}{:>8.1f}".format(
+                row['method'], row['calls'], row['total_s'], row['mean_us'], row['percent'])
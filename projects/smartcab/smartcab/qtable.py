@@ -0,0 +1,94 @@
+import random
+import numpy as np
+
+# Values of each state component, in encoding order
+waypoint_values = [None, 'forward', 'left', 'right']
+light_values = ['green', 'red']
+traffic_values = [None, 'forward', 'left', 'right']
+
+_waypoint_codes = dict((value, i) for i, value in enumerate(waypoint_values))
+_light_codes = dict((value, i) for i, value in enumerate(light_values))
+_traffic_codes = dict((value, i) for i, value in enumerate(traffic_values))
+
+# waypoint x light x oncoming x left x right
+n_states = len(waypoint_values) * len(light_values) * len(traffic_values) ** 3
+n_actions = 4  # indices into Environment.valid_actions
+
+
+def encode_state(waypoint, inputs):
+    """ Encodes the next waypoint and sensed inputs as a single integer. """
+
+    state = _waypoint_codes[waypoint]
+    state = state * len(light_values) + _light_codes[inputs['light']]
+    state = state * len(traffic_values) + _traffic_codes[inputs['oncoming']]
+    state = state * len(traffic_values) + _traffic_codes[inputs['left']]
+    state = state * len(traffic_values) + _traffic_codes[inputs['right']]
+    return state
+
+
+def decode_state(state):
+    """ Inverse of encode_state, as (waypoint, light, oncoming, left, right). """
+
+    state, right = divmod(state, len(traffic_values))
+    state, left = divmod(state, len(traffic_values))
+    state, oncoming = divmod(state, len(traffic_values))
+    waypoint, light = divmod(state, len(light_values))
+    return (waypoint_values[waypoint], light_values[light], traffic_values[oncoming],
+            traffic_values[left], traffic_values[right])
+
+
+class QTable(object):
+    """ Q-values of every (state, action) pair in one contiguous array. """
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else np.zeros((n_states, n_actions))
+
+    def best_action(self, state, rng=random):
+        """ Greedy action for a state, breaking ties at random. """
+
+        row = self.values[state]
+        best = np.flatnonzero(row == row.max())
+        return int(best[0] if len(best) == 1 else best[rng.randrange(len(best))])
+
+    def choose_action(self, state, epsilon, rng=random):
+        """ Epsilon-greedy action for a state. """
+
+        if rng.random() < epsilon:
+            return rng.randrange(n_actions)
+        return self.best_action(state, rng)
+
+    def choose_actions(self, states, epsilon, rng=np.random):
+        """ Epsilon-greedy actions for an array of states at once. """
+
+        rows = self.values[states]
+        # Random tie-break: argmax over the best actions after adding noise
+        noise = rng.random_sample(rows.shape)
+        greedy = np.where(rows == rows.max(axis=1)[:, None], noise + 1.0, noise).argmax(axis=1)
+        explore = rng.random_sample(len(rows)) < epsilon
+        return np.where(explore, rng.randint(0, n_actions, size=len(rows)), greedy)
+
+    def update(self, state, action, reward, alpha):
+        """ Moves Q(state, action) towards the received reward. """
+
+        self.values[state, action] += alpha * (reward - self.values[state, action])
+
+    def update_batch(self, states, actions, rewards, alpha, next_states=None, gamma=0.0):
+        """ Moves each Q(state, action) of a batch towards its reward plus the
+        discounted value of its next state, all from the current values.
+        Next states below zero are terminal and add no future value. """
+
+        targets = np.asarray(rewards, dtype=np.float64)
+        if next_states is not None and gamma:
+            next_states = np.asarray(next_states)
+            future = self.values[next_states].max(axis=1)
+            targets = targets + gamma * np.where(next_states >= 0, future, 0.0)
+        errors = targets - self.values[states, actions]
+        # add.at accumulates the updates of repeated (state, action) pairs
+        np.add.at(self.values, (states, actions), alpha * errors)
+
+    def save(self, filename):
+        np.save(filename, self.values)
+
+    @classmethod
+    def load(cls, filename):
+        return cls(np.load(filename))
@@ -0,0 +1,184 @@
+import struct
+
+import numpy as np
+
+# Trace file layout: the magic bytes, a header of int32 values, then
+# fixed-width int8 records whose first byte is the record kind
+magic = 'SCTR'
+version = 1
+header = struct.Struct('<4s6i')  # magic, version, cols, rows, agents, lights, record width
+
+TRIAL = 1  # trial start: agent spawns, destination, deadline and light states
+STEP = 2  # step: the action of every agent and the lights that switched
+DONE = 0x80  # flag of a STEP kind byte: the trial ended during the step, so its deadline did not run down
+
+# Heading changes of valid_actions [None, 'forward', 'left', 'right'] and
+# the offsets of the ENWS headings
+turns = np.array([0, 0, 1, 3])
+heading_offsets = np.array([(1, 0), (0, -1), (-1, 0), (0, 1)])
+
+
+def record_width(n_agents, n_lights):
+    """Bytes per record: a trial record holds x, y and heading of every agent,
+    the destination, a two-byte deadline and the light states as bits. """
+
+    return 1 + 3 * n_agents + 4 + (n_lights + 7) // 8
+
+
+class TraceRecorder(object):
+    """Records the trials of an environment into a binary trace file.
+
+    Each step stores one byte per agent, packing its action code (bits
+    0-1), whether the move was allowed (bit 2) and its next waypoint
+    code (bits 3-4), followed by the lights that switched as bits.
+    Grids are limited to 127 x 127, so locations fit in one byte.
+    """
+
+    def __init__(self, env, filename, buffer_size=1000):
+        assert max(env.grid_size) < 128, "Grid too large to trace"
+        self.env = env
+        self.filename = filename
+        self.buffer_size = buffer_size  # records held before each write
+        self.n_agents = len(env.agent_states)
+        self.n_lights = len(env.locations)
+        self.width = record_width(self.n_agents, self.n_lights)
+        self.records = []
+        self.actions = np.zeros(self.n_agents, dtype=np.uint8)  # of the current step
+
+        self.trace_file = open(filename, 'wb')
+        self.trace_file.write(header.pack(magic, version, env.grid_size[0], env.grid_size[1],
+                                          self.n_agents, self.n_lights, self.width))
+        env.recorder = self
+
+    def start_trial(self):
+        """Records the state of a freshly reset environment."""
+
+        env = self.env
+        agents = env.agents
+        primary = env.agent_states[env.primary_agent] if env.primary_agent is not None else None
+        destination = primary['destination'] if primary is not None else None
+        deadline = primary['deadline'] if primary is not None else None
+
+        record = np.zeros(self.width, dtype=np.uint8)
+        record[0] = TRIAL
+        n = self.n_agents
+        record[1:1 + n] = agents.x[:n]
+        record[1 + n:1 + 2 * n] = agents.y[:n]
+        record[1 + 2 * n:1 + 3 * n] = agents.heading[:n]
+        offset = 1 + 3 * n
+        if destination is not None:
+            record[offset:offset + 2] = destination
+        if deadline is not None:
+            record[offset + 2:offset + 4] = divmod(deadline & 0xffff, 256)
+        lights = np.packbits(env.lights.state)
+        record[offset + 4:offset + 4 + len(lights)] = lights
+        self.add(record)
+
+    def record_action(self, id, action, move_okay, waypoint):
+        self.actions[id] = action | move_okay << 2 | waypoint << 3
+
+    def record_step(self, switched):
+        record = np.zeros(self.width, dtype=np.uint8)
+        record[0] = STEP | (DONE if self.env.done else 0)
+        record[1:1 + self.n_agents] = self.actions
+        flips = np.packbits(switched)
+        record[1 + self.n_agents:1 + self.n_agents + len(flips)] = flips
+        self.actions[:] = 0  # agents that do not act stay put
+        self.add(record)
+
+    def add(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            self.trace_file.write(np.concatenate(self.records).tostring())
+            self.records = []
+        self.trace_file.flush()
+
+    def close(self):
+        self.flush()
+        self.trace_file.close()
+        self.env.recorder = None
+
+
+class Trial(object):
+    """One trial rebuilt from a trace, as arrays with one row per frame:
+    frame 0 is the state after reset and frame k the state after step k. """
+
+    def __init__(self, x, y, heading, lights, actions, move_okay, waypoints, destination, deadline):
+        self.x = x  # (frames, agents)
+        self.y = y
+        self.heading = heading  # indices into Environment.valid_headings
+        self.lights = lights  # (frames, lights), True = NS open
+        self.actions = actions  # (steps, agents) action codes
+        self.move_okay = move_okay
+        self.waypoints = waypoints  # next waypoint codes at each step
+        self.destination = destination  # of the primary agent, or None
+        self.deadline = deadline  # of the primary agent at each frame, or None
+
+    def __len__(self):
+        return len(self.lights)
+
+
+class Replayer(object):
+    """Reads a trace file, rebuilding any recorded trial without running
+    the earlier ones. Records are memory-mapped, and trials are found
+    through an index of their start records. """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            values = header.unpack(f.read(header.size))
+        assert values[0] == magic, "Not a smartcab trace"
+        self.grid_size = values[2], values[3]
+        self.n_agents, self.n_lights, self.width = values[4:7]
+        self.records = np.memmap(filename, dtype=np.int8, mode='r', offset=header.size)
+        self.records = self.records[:len(self.records) // self.width * self.width].reshape(-1, self.width)
+        self.starts = np.flatnonzero(self.records[:, 0] == TRIAL)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def trial(self, i):
+        """Rebuilds trial i, counted from 0."""
+
+        start = self.starts[i]
+        end = self.starts[i + 1] if i + 1 < len(self.starts) else len(self.records)
+        first = self.records[start].view(np.uint8)
+        steps = self.records[start + 1:end].view(np.uint8)
+        n = self.n_agents
+        cols, rows = self.grid_size
+
+        # Spawns and the first light states
+        x0 = first[1:1 + n].astype(int)
+        y0 = first[1 + n:1 + 2 * n].astype(int)
+        heading0 = first[1 + 2 * n:1 + 3 * n].astype(int)
+        offset = 1 + 3 * n
+        destination = tuple(first[offset:offset + 2].tolist())
+        deadline = int(first[offset + 2]) * 256 + int(first[offset + 3])
+        deadline = deadline - 0x10000 if deadline >= 0x8000 else deadline
+        lights0 = np.unpackbits(first[offset + 4:])[:self.n_lights].astype(bool)
+
+        # Steps: turn and move the agents whose actions were allowed
+        codes = steps[:, 1:1 + n]
+        actions = codes & 3
+        move_okay = (codes >> 2 & 1).astype(bool)
+        waypoints = codes >> 3 & 3
+        moved = move_okay & (actions != 0)
+        heading = (heading0 + np.cumsum(np.where(moved, turns[actions], 0), axis=0)) % 4
+        dx = np.where(moved, heading_offsets[heading, 0], 0)
+        dy = np.where(moved, heading_offsets[heading, 1], 0)
+        x = (x0 - 1 + np.cumsum(dx, axis=0)) % cols + 1
+        y = (y0 - 1 + np.cumsum(dy, axis=0)) % rows + 1
+        flips = np.unpackbits(steps[:, 1 + n:], axis=1)[:, :self.n_lights]
+        lights = lights0 ^ (np.cumsum(flips, axis=0) % 2).astype(bool)
+
+        # The deadline runs down after every step except one that ended the trial
+        running = (steps[:, 0] & DONE) == 0
+        deadlines = deadline - np.concatenate([[0], np.cumsum(running)])
+        has_destination = destination != (0, 0)
+        return Trial(np.vstack([x0, x]), np.vstack([y0, y]), np.vstack([heading0, heading]),
+                     np.vstack([lights0, lights]), actions, move_okay, waypoints,
+                     destination if has_destination else None,
+                     deadlines if has_destination else None)
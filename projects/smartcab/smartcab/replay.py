@@ -0,0 +1,50 @@
+import numpy as np
+
+# Next state of a transition that ended a trial
+terminal = -1
+
+
+class ReplayBuffer(object):
+    """ Fixed-capacity ring buffer of (state, action, reward, next_state)
+    transitions, held in preallocated arrays. Once full, each new
+    transition overwrites the oldest one. """
+
+    def __init__(self, capacity=10000, rng=None):
+        self.capacity = capacity
+        self.random = rng if rng is not None else np.random
+        self.states = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int32)
+        self.position = 0  # slot written next
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state=terminal):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """ Draws batch_size stored transitions uniformly, with replacement,
+        as (states, actions, rewards, next_states) arrays. """
+
+        i = self.random.randint(0, self.size, size=batch_size)
+        return self.states[i], self.actions[i], self.rewards[i], self.next_states[i]
+
+    def clear(self):
+        self.position = 0
+        self.size = 0
+
+
+def discounted_return(rewards, gamma):
+    """ Sum of rewards, each discounted by gamma for every step before it. """
+
+    rewards = np.asarray(rewards, dtype=np.float64)
+    return float(np.dot(rewards, gamma ** np.arange(len(rewards))))
@@ -1,3 +0,0 @@
-returns += reward * totalDiscount
-totalDiscount *= discount
-
@@ -0,0 +1,83 @@
+import os
+import random
+import itertools
+import multiprocessing
+
+import pandas as pd
+
+from environment import Environment
+from agent import LearningAgent
+from simulator import Simulator
+from metrics import TrialLogger, outcome_fields
+
+
+def make_configs(seeds, param_sets, n_trials=20, n_test=10, num_dummies=3):
+    """Builds one simulation config for every (seed, parameter set) pair.
+    Each parameter set is a dict of keyword arguments for LearningAgent."""
+
+    return [{'seed': seed,
+             'agent': dict(params),
+             'n_trials': n_trials,
+             'n_test': n_test,
+             'num_dummies': num_dummies}
+            for params, seed in itertools.product(param_sets, seeds)]
+
+
+def run_simulation(config):
+    """Runs one seeded simulation and returns the metrics of each trial."""
+
+    # One seeded generator drives the environment, lights, dummies and planner
+    rng = random.Random(config['seed'])
+    env = Environment(num_dummies=config.get('num_dummies', 3), verbose=False, rng=rng)
+    agent = env.create_agent(LearningAgent, **config.get('agent', {}))
+    env.set_primary_agent(agent, enforce_deadline=True)
+
+    sim = Simulator(env, headless=True)
+    sim.log = TrialLogger()  # keep the rows in memory
+    sim.run(n_trials=config.get('n_trials', 20))
+    sim.run(n_trials=config.get('n_test', 0), testing=True)
+    return sim.log.rows
+
+
+def run_sweep(configs, processes=None):
+    """Runs simulations in parallel over a process pool.
+
+    Returns one table of trial metrics, in the plot_trials schema, with
+    'run' (index into configs) and 'seed' columns identifying each run,
+    plus typed outcome, epsilon and alpha columns for visuals.grade_runs.
+    """
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(run_simulation, configs)
+    finally:
+        pool.close()
+        pool.join()
+
+    frames = []
+    for run, (config, rows) in enumerate(zip(configs, results)):
+        frame = pd.DataFrame(rows, columns=TrialLogger.fields)
+        records = TrialLogger.records(rows)
+        for field in outcome_fields + ['epsilon', 'alpha']:
+            frame[field] = records[field]
+        frame.insert(0, 'run', run)
+        frame.insert(1, 'seed', config['seed'])
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def save_run(results, run, log_file):
+    """Writes the trials of one run to logs/, ready for visuals.plot_trials."""
+
+    if not os.path.exists("logs"):
+        os.makedirs("logs")
+    trials = results[results['run'] == run]
+    trials[TrialLogger.fields].to_csv(os.path.join("logs", log_file), index=False)
+
+
+if __name__ == '__main__':
+    configs = make_configs(seeds=range(8),
+                           param_sets=[{'learning': True, 'alpha': alpha} for alpha in [0.2, 0.5, 0.8]])
+    results = run_sweep(configs)
+    testing = results[results['testing'] == True]
+    print testing.groupby('run')[['net_reward', 'success']].mean()
@@ -2,7 +2,11 @@ import os
 import time
 import random
 import importlib
-import pygame
+
+from metrics import TrialLogger
+import checkpoint
+import recorder
+import profiler
 
 class Simulator(object):
     """Simulates agents in a dynamic smartcab environment.
@@ -21,7 +25,7 @@ class Simulator(object):
         'orange'  : (255, 128,   0)
     }
 
-    def __init__(self, env, size=None, update_delay=1.0, display=True):
+    def __init__(self, env, size=None, update_delay=1.0, display=True, headless=False, log_metrics=False, log_file=None, cached_render=False, profile=False):
         self.env = env
         self.size = size if size is not None else ((self.env.grid_size[0] + 1) * self.env.block_size, (self.env.grid_size[1] + 1) * self.env.block_size)
         self.width, self.height = self.size
@@ -35,9 +39,36 @@ class Simulator(object):
         self.trials = 1
         self.current_time = 0.0
         self.last_updated = 0.0
+        self.steps_per_sec = None  # achieved by the last headless run
         self.update_delay = update_delay  # duration between each step (in secs)
 
-        self.display = display
+        # Headless mode steps the environment back to back, without a GUI
+        self.headless = headless
+        self.display = display and not headless
+
+        # Per-trial metrics, written to logs/ for visuals.plot_trials
+        self.log_metrics = log_metrics
+        self.testing = False
+        self.log = None
+        if self.log_metrics:
+            if log_file is None:
+                learning = getattr(self.env.primary_agent, 'learning', False)
+                log_file = 'sim_default-learning.csv' if learning else 'sim_no-learning.csv'
+            self.log = TrialLogger(os.path.join("logs", log_file))
+
+        # Profiling times the main simulation methods during each run and
+        # prints a table at its end; a filename for profile writes JSON instead
+        self.profile = profile
+        self.profiler = profiler.Profiler() if profile else None
+
+        # Cached rendering draws the road network once and only updates
+        # the parts of the screen that change between frames
+        self.cached_render = cached_render
+        self.static_layer = None
+        self.text_cache = {}
+        self.light_cache = {}
+        self.dirty_rects = []
+
         if self.display:
             try:
                 self.pygame = importlib.import_module('pygame')
@@ -50,6 +81,10 @@ class Simulator(object):
                 for agent in self.env.agent_states:
                     agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.agent_sprite_size)
                     agent._sprite_size = (agent._sprite.get_width(), agent._sprite.get_height())
+                    if self.cached_render:
+                        # Sprite rotated for each heading
+                        agent._sprites = dict((heading, self.rotate_sprite(agent._sprite, heading))
+                                              for heading in self.env.valid_headings)
 
                 self.font = self.pygame.font.Font(None, 24)
                 self.paused = False
@@ -60,57 +95,259 @@ class Simulator(object):
                 self.display = False
                 print "Simulator.__init__(): Error initializing GUI objects; display disabled.\n{}: {}".format(e.__class__.__name__, e)
 
-    def run(self, n_trials=1):
+    def run(self, n_trials=1, testing=False, checkpoint_file=None, checkpoint_every=100):
+        """Runs n_trials trials. With a checkpoint_file, a snapshot of the
+        simulation is saved there every checkpoint_every trials, from
+        which checkpoint.resume can continue the run. """
+
+        self.testing = testing
+        if self.profiler is not None:
+            self.profiler.reset()
+            self.profiler.enable(self)
+        try:
+            if self.headless:
+                self.run_headless(n_trials, checkpoint_file, checkpoint_every)
+                return
+
+            self.quit = False
+            self.trials = n_trials
+            for trial in xrange(n_trials):
+                # Fix: added `+1` to @trial
+                # When it prints it will start with "trial 1"
+                # [debug]
+                if self.env.verbose:
+                    print "Simulator.run(): Trial {}".format(trial + 1)
+                self.env.reset(testing=self.testing)
+                self.current_time = 0.0
+                self.last_updated = 0.0
+                self.start_time = time.time()
+                while True:
+                    try:
+                        # Update current time
+                        self.current_time = time.time() - self.start_time
+                        # print "Simulator.run(): current_time = {:.3f}".format(self.current_time)
+
+                        # Handle GUI events
+                        if self.display:
+                            for event in self.pygame.event.get():
+                                if event.type == self.pygame.QUIT:
+                                    self.quit = True
+                                elif event.type == self.pygame.KEYDOWN:
+                                    if event.key == 27:  # Esc
+                                        self.quit = True
+                                    elif event.unicode == u' ':
+                                        self.paused = True
+
+                            if self.paused:
+                                self.pause()
+
+                        # Update environment
+                        if self.current_time - self.last_updated >= self.update_delay:
+                            self.env.step()
+                            self.last_updated = self.current_time
+
+                        # Render GUI and sleep
+                        if self.display:
+                            self.render()
+                            self.pygame.time.wait(self.frame_delay)
+                    except KeyboardInterrupt:
+                        self.quit = True
+                    finally:
+                        if self.quit or self.env.done:
+                            break
+
+                if self.env.done:
+                    self.log_trial()
+                    if checkpoint_file is not None and (trial + 1) % checkpoint_every == 0:
+                        checkpoint.save(self, checkpoint_file, n_trials - trial - 1)
+                if self.quit:
+                    break
+
+            if self.log is not None:
+                self.log.flush()
+        finally:
+            self.report_profile()
+
+    def report_profile(self):
+        """Stops profiling the last run and reports its timings."""
+
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        self.profiler.report(self.profile if isinstance(self.profile, basestring) else None)
+
+    def run_headless(self, n_trials=1, checkpoint_file=None, checkpoint_every=100):
+        """Run trials as fast as possible, ignoring update_delay."""
+
         self.quit = False
         self.trials = n_trials
-        for trial in xrange(n_trials):
-            # Fix: added `+1` to @trial
-            # When it prints it will start with "trial 1"
-            # [debug]
-            print "Simulator.run(): Trial {}".format(trial + 1)
-            self.env.reset()
-            self.current_time = 0.0
-            self.last_updated = 0.0
-            self.start_time = time.time()
-            while True:
-                try:
-                    # Update current time
-                    self.current_time = time.time() - self.start_time
-                    # print "Simulator.run(): current_time = {:.3f}".format(self.current_time)
-
-                    # Handle GUI events
-                    if self.display:
-                        for event in self.pygame.event.get():
-                            if event.type == self.pygame.QUIT:
-                                self.quit = True
-                            elif event.type == self.pygame.KEYDOWN:
-                                if event.key == 27:  # Esc
-                                    self.quit = True
-                                elif event.unicode == u' ':
-                                    self.paused = True
-
-                        if self.paused:
-                            self.pause()
-
-                    # Update environment
-                    if self.current_time - self.last_updated >= self.update_delay:
-                        self.env.step()
-                        self.last_updated = self.current_time
-
-                    # Render GUI and sleep
-                    if self.display:
-                        self.render()
-                        self.pygame.time.wait(self.frame_delay)
-                except KeyboardInterrupt:
-                    self.quit = True
-                finally:
-                    if self.quit or self.env.done:
-                        break
+        n_steps = 0
+        start_time = time.time()
+        try:
+            for trial in xrange(n_trials):
+                if self.env.verbose:
+                    print "Simulator.run(): Trial {}".format(trial + 1)
+                self.env.reset(testing=self.testing)
+                while not self.env.done:
+                    self.env.step()
+                    n_steps += 1
+                self.log_trial()
+                if checkpoint_file is not None and (trial + 1) % checkpoint_every == 0:
+                    checkpoint.save(self, checkpoint_file, n_trials - trial - 1)
+        except KeyboardInterrupt:
+            self.quit = True
+        elapsed = time.time() - start_time
+        if self.log is not None:
+            self.log.flush()
+
+        self.steps_per_sec = n_steps / elapsed if elapsed > 0 else float('inf')
+        if self.env.verbose:
+            print "Simulator.run(): {} steps in {:.3f} secs ({:.1f} steps/sec)".format(
+                n_steps, elapsed, self.steps_per_sec)
+
+    def replay(self, trace_file, trial):
+        """Shows a trial recorded by recorder.TraceRecorder, rebuilt from the
+        trace instead of simulated. The environment must have the same
+        grid and agents as the one that was recorded. """
 
+        frames = recorder.Replayer(trace_file).trial(trial)
+        env = self.env
+        agents = env.agents
+        n = agents.size
+        primary = env.agent_states[env.primary_agent].id if env.primary_agent is not None else None
+        if primary is not None and frames.destination is not None:
+            agents.destination_x[primary], agents.destination_y[primary] = frames.destination
+
+        self.quit = False
+        for k in xrange(len(frames)):
+            agents.x[:n] = frames.x[k]
+            agents.y[:n] = frames.y[k]
+            agents.heading[:n] = frames.heading[k]
+            env.lights.state[:] = frames.lights[k]
+            env.t = k
+            if k > 0:
+                for agent, waypoint in zip(env.agent_states, frames.waypoints[k - 1]):
+                    agent.next_waypoint = env.valid_actions[waypoint]
+            if frames.deadline is not None:
+                env.status_text = "trial: {}\nstep: {}\ndeadline: {}".format(trial, k, frames.deadline[k])
+                if primary is not None:
+                    agents.deadline[primary] = frames.deadline[k]
+
+            if not self.display:
+                continue
+            for event in self.pygame.event.get():
+                if event.type == self.pygame.QUIT or (event.type == self.pygame.KEYDOWN and event.key == 27):
+                    self.quit = True
             if self.quit:
                 break
+            self.render()
+            self.pygame.time.wait(max(self.frame_delay, int(self.update_delay * 1000)))
+
+        # Locations were written to the registry directly
+        env.rebuild_occupants()
+
+    def log_trial(self):
+        """Adds the metrics of the finished trial to the log."""
+
+        if self.log is None:
+            return
+        agent = self.env.primary_agent
+        parameters = {'e': getattr(agent, 'epsilon', 0.0), 'a': getattr(agent, 'alpha', 0.0)}
+        self.log.log_trial(self.env.trial_data, testing=self.testing, parameters=parameters)
+
+    def rotate_sprite(self, sprite, heading):
+        return sprite if heading == (1, 0) else self.pygame.transform.rotate(sprite, 180 if heading[0] == -1 else heading[1] * -90)
+
+    def render_text(self, text, color):
+        """Text surface, rendered once per (text, color)."""
+
+        key = (text, color)
+        if key not in self.text_cache:
+            if len(self.text_cache) >= 1024:
+                self.text_cache.clear()
+            self.text_cache[key] = self.font.render(text, True, color, self.bg_color)
+        return self.text_cache[key]
+
+    def build_static_layer(self):
+        """Draws the background and road network once, to be reused by every frame."""
+
+        self.static_layer = self.pygame.Surface(self.size)
+        self.static_layer.fill(self.bg_color)
+        for road in self.env.roads:
+            self.pygame.draw.line(self.static_layer, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
+        for intersection in self.env.intersections:
+            self.pygame.draw.circle(self.static_layer, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), 10)
+
+    def render_cached(self):
+        """Renders a frame by redrawing only what changed since the last one."""
+
+        first_frame = self.static_layer is None
+        if first_frame:
+            self.build_static_layer()
+            self.screen.blit(self.static_layer, (0, 0))
+            self.light_cache = {}
+            self.dirty_rects = []
+
+        # Erase the dynamic elements of the last frame and lights that switched
+        lights = []
+        for intersection, index in self.env.intersections.iteritems():
+            pos = (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size)
+            rect = self.pygame.rect.Rect(pos[0] - 15 - self.road_width, pos[1] - 15 - self.road_width, 30 + 2 * self.road_width, 30 + 2 * self.road_width)
+            state = self.env.lights.state.item(index)
+            lights.append((pos, rect, state))
+            if self.light_cache.get(intersection) != state:
+                self.light_cache[intersection] = state
+                self.dirty_rects.append(rect)
+        restored = self.dirty_rects
+        for rect in restored:
+            self.screen.blit(self.static_layer, rect, rect)
+
+        # * Lights under the erased areas
+        for pos, rect, state in lights:
+            if first_frame or rect.collidelist(restored) != -1:
+                if state:  # North-South is open
+                    self.pygame.draw.line(self.screen, self.colors['green'], (pos[0], pos[1] - 15), (pos[0], pos[1] + 15), self.road_width)
+                else:  # East-West is open
+                    self.pygame.draw.line(self.screen, self.colors['green'], (pos[0] - 15, pos[1]), (pos[0] + 15, pos[1]), self.road_width)
+
+        # * Dynamic elements
+        drawn = []
+        for agent, state in self.env.agent_states.iteritems():
+            # Compute precise agent location here (back from the intersection some)
+            agent_offset = (2 * state['heading'][0] * self.agent_circle_radius, 2 * state['heading'][1] * self.agent_circle_radius)
+            agent_pos = (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
+            agent_color = self.colors[agent.color]
+            if hasattr(agent, '_sprites'):
+                drawn.append(self.screen.blit(agent._sprites[state['heading']],
+                    self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
+                        agent._sprite_size[0], agent._sprite_size[1])))
+            else:
+                drawn.append(self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius))
+                drawn.append(self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width))
+            if agent.get_next_waypoint() is not None:
+                drawn.append(self.screen.blit(self.render_text(agent.get_next_waypoint(), agent_color), (agent_pos[0] + 10, agent_pos[1] + 10)))
+            if state['destination'] is not None:
+                drawn.append(self.pygame.draw.circle(self.screen, agent_color, (state['destination'][0] * self.env.block_size, state['destination'][1] * self.env.block_size), 6))
+                drawn.append(self.pygame.draw.circle(self.screen, agent_color, (state['destination'][0] * self.env.block_size, state['destination'][1] * self.env.block_size), 15, 2))
+
+        # * Overlays
+        text_y = 5
+        for text in self.env.status_text.split('\n'):
+            drawn.append(self.screen.blit(self.render_text(text, self.colors['red']), (100, text_y)))
+            text_y += 20
+
+        # Update only the changed areas of the display
+        if first_frame:
+            self.pygame.display.flip()
+        else:
+            self.pygame.display.update(restored + drawn)
+        self.dirty_rects = drawn
 
     def render(self):
+        if self.cached_render:
+            self.render_cached()
+            return
+
         # Clear screen
         self.screen.fill(self.bg_color)
 
@@ -119,9 +356,9 @@ class Simulator(object):
         for road in self.env.roads:
             self.pygame.draw.line(self.screen, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
 
-        for intersection, traffic_light in self.env.intersections.iteritems():
+        for intersection, index in self.env.intersections.iteritems():
             self.pygame.draw.circle(self.screen, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), 10)
-            if traffic_light.state:  # North-South is open
+            if self.env.lights.state.item(index):  # North-South is open
                 self.pygame.draw.line(self.screen, self.colors['green'],
                     (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size - 15),
                     (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size + 15), self.road_width)
@@ -14,11 +14,70 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import os
-import ast
+import re
+import csv
+from collections import deque
+
+from smartcab.metrics import TRIAL_DTYPE, outcome_fields, is_binary, load_trials as load_records
+
+# Typed columns of the action outcome counts, in the order of the
+# 'actions' dict keys (0 = good, ..., 4 = major accident)
+outcome_columns = outcome_fields
+
+# Bad action frequencies shown in the plots, by outcome column
+rate_columns = {'good_actions': 'good', 'minor_violations': 'minor', 'major_violations': 'major',
+	'minor_accidents': 'minor_acc', 'major_accidents': 'major_acc'}
+
+action_pattern = re.compile(r"(\d+)\s*:\s*(\d+)")
+parameter_patterns = {'epsilon': re.compile(r"'e'\s*:\s*([-+.\deE]+)"),
+	'alpha': re.compile(r"'a'\s*:\s*([-+.\deE]+)")}
+
+
+def parse_actions(text):
+	""" Outcome counts of one 'actions' entry, as a list indexed by outcome. """
+
+	counts = [0] * len(outcome_columns)
+	for outcome, count in action_pattern.findall(text):
+		counts[int(outcome)] = int(count)
+	return counts
+
+
+def parse_parameter(text, name):
+	match = parameter_patterns[name].search(text)
+	return float(match.group(1)) if match else np.nan
+
+
+def load_trials(csv):
+	""" Reads a trial log from logs/ and parses its 'actions' and 'parameters'
+	strings, once, into typed outcome, epsilon and alpha columns. Binary
+	.trials logs already hold these columns. """
+
+	if is_binary(csv):
+		return pd.DataFrame(load_records(os.path.join("logs", csv)))
+	data = pd.read_csv(os.path.join("logs", csv))
+	counts = np.array([parse_actions(text) for text in data['actions']], dtype=int).reshape(-1, len(outcome_columns))
+	for i, column in enumerate(outcome_columns):
+		data[column] = counts[:, i]
+	for name in parameter_patterns:
+		data[name] = data['parameters'].str.extract(parameter_patterns[name].pattern, expand=False).astype(float)
+	return data.drop(['actions', 'parameters'], axis=1)
+
+
+def add_rolling_metrics(data, window=10):
+	""" Adds the rolling-window averages shown by plot_trials. """
+
+	steps = (data['initial_deadline'] - data['final_deadline']) * 1.0
+	data['average_reward'] = (data['net_reward'] / steps).rolling(window=window, center=False).mean()
+	data['reliability_rate'] = (data['success']*100).rolling(window=window, center=False).mean()
+	for column in outcome_columns:
+		data[rate_columns[column]] = (data[column] / steps).rolling(window=window, center=False).mean()
+	return data
 
 
 def calculate_safety(data):
-	""" Calculates the safety rating of the smartcab during testing. """
+	""" Calculates the safety rating of the smartcab during testing.
+	data can be a DataFrame from load_trials or the structured array of a
+	binary log, e.g. records[records['testing']]. """
 
 	good_ratio = data['good_actions'].sum() * 1.0 / \
 	(data['initial_deadline'] - data['final_deadline']).sum()
@@ -26,14 +85,14 @@ def calculate_safety(data):
 	if good_ratio == 1: # Perfect driving
 		return ("A+", "green")
 	else: # Imperfect driving
-		if data['actions'].apply(lambda x: ast.literal_eval(x)[4]).sum() > 0: # Major accident
+		if data['major_accidents'].sum() > 0: # Major accident
 			return ("F", "red")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[3]).sum() > 0: # Minor accident
+		elif data['minor_accidents'].sum() > 0: # Minor accident
 			return ("D", "#EEC700")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[2]).sum() > 0: # Major violation
+		elif data['major_violations'].sum() > 0: # Major violation
 			return ("C", "#EEC700")
 		else: # Minor violation
-			minor = data['actions'].apply(lambda x: ast.literal_eval(x)[1]).sum()
+			minor = data['minor_violations'].sum()
 			if minor >= len(data)/2: # Minor violation in at least half of the trials
 				return ("B", "green")
 			else:
@@ -41,7 +100,8 @@ def calculate_safety(data):
 
 
 def calculate_reliability(data):
-	""" Calculates the reliability rating of the smartcab during testing. """
+	""" Calculates the reliability rating of the smartcab during testing.
+	Accepts the same data as calculate_safety. """
 
 	success_ratio = data['success'].sum() * 1.0 / len(data)
 
@@ -60,10 +120,59 @@ def calculate_reliability(data):
 			return ("F", "red")
 
 
+# Grades from best to worst, for ranking runs
+grade_order = ["A+", "A", "B", "C", "D", "F"]
+
+
+def grade_runs(data, by='run'):
+	""" Grades the testing trials of many runs at once, as calculate_safety and
+	calculate_reliability would grade each run, and ranks the runs.
+
+	data holds the trials of all runs with typed outcome columns and a
+	column identifying the run: a DataFrame (e.g. from runner.run_sweep)
+	or a structured array of stacked records. Returns a leaderboard with
+	one row per run, best first.
+	"""
+
+	data = pd.DataFrame(data) if isinstance(data, np.ndarray) else data
+	if 'testing' in data:
+		data = data[data['testing'] == True]
+	data = data.assign(steps=data['initial_deadline'] - data['final_deadline'])
+	runs = data.groupby(by).agg(dict([(column, 'sum') for column in outcome_columns + ['steps', 'success']] +
+		[('net_reward', 'mean'), ('trial', 'size')]))
+	runs = runs.rename(columns={'trial': 'trials'})
+	good_ratio = runs['good_actions'] * 1.0 / runs['steps']
+	success_ratio = runs['success'] * 1.0 / runs['trials']
+
+	safety = np.select([good_ratio == 1, runs['major_accidents'] > 0, runs['minor_accidents'] > 0,
+		runs['major_violations'] > 0, runs['minor_violations'] >= runs['trials'] // 2],
+		["A+", "F", "D", "C", "B"], "A")
+	reliability = np.select([success_ratio == 1, success_ratio >= 0.90, success_ratio >= 0.80,
+		success_ratio >= 0.70, success_ratio >= 0.60],
+		["A+", "A", "B", "C", "D"], "F")
+
+	leaderboard = pd.DataFrame({'trials': runs['trials'],
+		'safety': safety,
+		'reliability': reliability,
+		'good_ratio': good_ratio,
+		'success_ratio': success_ratio,
+		'net_reward': runs['net_reward']},
+		columns=['trials', 'safety', 'reliability', 'good_ratio', 'success_ratio', 'net_reward'])
+
+	# Rank by safety, then reliability, then the ratios behind them
+	leaderboard['safety_rank'] = pd.Categorical(leaderboard['safety'], grade_order, ordered=True).codes
+	leaderboard['reliability_rank'] = pd.Categorical(leaderboard['reliability'], grade_order, ordered=True).codes
+	leaderboard = leaderboard.sort_values(['safety_rank', 'reliability_rank', 'good_ratio', 'success_ratio', 'net_reward'],
+		ascending=[True, True, False, False, False])
+	leaderboard = leaderboard.drop(['safety_rank', 'reliability_rank'], axis=1)
+	leaderboard['rank'] = np.arange(1, len(leaderboard) + 1)
+	return leaderboard.reset_index()
+
+
 def plot_trials(csv):
 	""" Plots the data from logged metrics during a simulation."""
 
-	data = pd.read_csv(os.path.join("logs", csv))
+	data = load_trials(csv)
 
 	if len(data) < 10:
 		print "Not enough data collected to create a visualization."
@@ -71,21 +180,7 @@ def plot_trials(csv):
 		return
 	
 	# Create additional features
-	data['average_reward'] = (data['net_reward'] / (data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['reliability_rate'] = (data['success']*100).rolling(window=10, center=False).mean()  # compute avg. net reward with window=10
-	data['good_actions'] = data['actions'].apply(lambda x: ast.literal_eval(x)[0])
-	data['good'] = (data['good_actions'] * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['minor'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[1]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['major'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[2]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['minor_acc'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[3]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['major_acc'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[4]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['epsilon'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['e']) 
-	data['alpha'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['a']) 
+	data = add_rolling_metrics(data, window=10)
 
 
 	# Create training and testing subsets
@@ -205,3 +300,94 @@ def plot_trials(csv):
 
 	plt.tight_layout()
 	plt.show()
+
+
+class TrialTail(object):
+	""" Follows a trial log as it is being written, e.g. for a live dashboard
+	during training. Each call to update() parses only the rows added
+	since the last one, and keeps the rolling-window metrics of the
+	training trials up to date with running sums. """
+
+	def __init__(self, csv_file, window=10):
+		self.filename = os.path.join("logs", csv_file)
+		self.window = window
+		self.position = 0  # bytes of the file read so far
+		self.columns = None
+		self.trials = 0  # training trials seen
+		self.recent = deque()  # per-trial values in the window
+		self.sums = np.zeros(2 + len(outcome_columns))
+		self.testing = []  # testing rows, with typed columns
+		self.history = []  # rolling metrics after each training trial
+
+	def update(self):
+		""" Reads new complete rows; returns the current rolling metrics. """
+
+		if not os.path.exists(self.filename):
+			return self.metrics()
+		with open(self.filename, 'rb') as f:
+			f.seek(self.position)
+			text = f.read()
+
+		if is_binary(self.filename):
+			end = len(text) // TRIAL_DTYPE.itemsize * TRIAL_DTYPE.itemsize
+			for record in np.frombuffer(text[:end], dtype=TRIAL_DTYPE):
+				self.add(dict(zip(TRIAL_DTYPE.names, record.tolist())))
+		else:
+			end = text.rfind('\n') + 1  # leave a partly written row for later
+			for row in csv.reader(text[:end].splitlines()):
+				if self.columns is None:
+					self.columns = row
+				elif row:
+					self.add(self.parse_row(dict(zip(self.columns, row))))
+		self.position += end
+		return self.metrics()
+
+	def parse_row(self, row):
+		""" Typed values of a CSV row, as in a binary log record. """
+
+		trial = {'trial': int(row['trial']),
+			'testing': row['testing'] == 'True',
+			'initial_deadline': int(row['initial_deadline']),
+			'final_deadline': int(row['final_deadline']),
+			'net_reward': float(row['net_reward']),
+			'success': int(row['success'])}
+		trial.update(zip(outcome_columns, parse_actions(row['actions'])))
+		for name in parameter_patterns:
+			trial[name] = parse_parameter(row['parameters'], name)
+		return trial
+
+	def add(self, trial):
+		if trial['testing']:
+			self.testing.append(trial)
+			return
+
+		# Slide the window: add this trial, drop the oldest
+		steps = (trial['initial_deadline'] - trial['final_deadline']) * 1.0
+		values = np.array([trial['net_reward'] / steps, trial['success'] * 100.0] +
+			[trial[column] / steps for column in outcome_columns])
+		self.recent.append(values)
+		self.sums += values
+		if len(self.recent) > self.window:
+			self.sums -= self.recent.popleft()
+		self.trials += 1
+		if len(self.recent) == self.window:
+			self.history.append(dict(self.metrics(), trial=trial['trial'],
+				epsilon=trial['epsilon'], alpha=trial['alpha']))
+
+	def metrics(self):
+		""" Rolling averages of the last window training trials, as named
+		in plot_trials; empty until a full window has been read. """
+
+		if len(self.recent) < self.window:
+			return {}
+		means = self.sums / self.window
+		metrics = {'average_reward': means[0], 'reliability_rate': means[1]}
+		for i, column in enumerate(outcome_columns):
+			metrics[rate_columns[column]] = means[2 + i]
+		return metrics
+
+	def testing_data(self):
+		""" Testing trials read so far, for calculate_safety and calculate_reliability. """
+
+		return pd.DataFrame(self.testing, columns=['trial', 'initial_deadline', 'final_deadline',
+			'net_reward', 'success'] + outcome_columns + list(parameter_patterns))